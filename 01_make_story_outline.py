@@ -1,110 +1,306 @@
-import requests
+import argparse
+import json
 import sys
 import os
-import json
+from concurrent.futures import ThreadPoolExecutor
+
+from atomic_files import write_text_atomic
+from build_manifest import BuildManifest, hash_inputs
+from gemini_client import get_client
+from story_outline import (CHAPTER_SCHEMA, OUTLINE_CONFIG, arc_parts, chapters_from_text, completed_path,
+                           distribute_chapters, number_chapters, outline_path, outline_text, parse_outline, save_outline, split_arcs)
+from thread_context import carry_context
 
-def get_gemini_completion(prompt, api_key):
+CHAPTER_COUNT = 100
+# Most chapters outlined by one request with --by-arc. Longer arcs are split into parts that are
+# outlined at the same time, so no reply has to hold more than this many long paragraphs.
+ARC_PART_CHAPTERS = 20
+
+def outline_prompt(story_info, chapter_count):
+    return f"Turn the following text into a {chapter_count} chapter story outline. For each chapter, provide a detailed, long paragraph describing the events and key developments. Maintain character and item name coherence.\n\n" + story_info
+
+def generate_outline(client, story_info, chapter_count):
     """
-    Sends a text prompt to the Gemini API and returns the generated completion.
+    Outlines the whole book in one request.
 
-    Args:
-        prompt (str): The text content to send to the model.
-        api_key (str): Your API key for the Google Generative Language API.
+    Returns:
+        list: The validated chapters, or None if the request failed.
+    """
+    prompt_text = outline_prompt(story_info, chapter_count)
+    result = client.generate(prompt_text, OUTLINE_CONFIG, stage="outline")
+
+    if not result.ok:
+        print(f"Failed to generate completion. Error: {result.error}")
+        return None
+
+    try:
+        return parse_outline(result.text)
+    except ValueError as e:
+        # Make sure a retry asks the API again instead of reading the bad response from the cache.
+        client.forget(prompt_text, OUTLINE_CONFIG)
+        print(f"The outline returned by the API is not valid: {e}")
+        return None
+
+def plan_arcs(client, manifest, story_info, arcs, chapter_count):
+    """
+    Asks for the key beats of every arc and how many chapters each should take.
 
     Returns:
-        str: The completed text from the model, or an error message.
+        list: One {"title", "beats", "chapters"} dict per arc, with chapter counts that add up
+        to `chapter_count`, or None if the request failed.
     """
-    url = "https://generativelanguage.googleapis.com/v1beta/models/gemini-2.5-flash-preview-05-20:generateContent"
-    headers = {
-        'Content-Type': 'application/json',
-        'X-goog-api-key': api_key
+    prompt = (
+        f"The plot of the novel described below is divided into {len(arcs)} arcs, and the novel will have "
+        f"{chapter_count} chapters. For each arc, in order, give it a short title, list its key story beats in "
+        f"the order they happen, and decide how many chapters it should span, so that the arcs together "
+        f"span all {chapter_count} chapters. Maintain character and item name coherence.\n\n{story_info}"
+    )
+    config = {
+        "responseMimeType": "application/json",
+        "responseSchema": {
+            "type": "ARRAY",
+            "minItems": len(arcs),
+            "maxItems": len(arcs),
+            "items": {
+                "type": "OBJECT",
+                "properties": {
+                    "title": {"type": "STRING"},
+                    "beats": {"type": "ARRAY", "items": {"type": "STRING"}},
+                    "chapters": {"type": "INTEGER"},
+                },
+                "required": ["title", "beats", "chapters"],
+            },
+        },
     }
-    payload = {
-        "contents": [
-            {
-                "parts": [
-                    {
-                        "text": prompt
-                    }
-                ]
-            }
-        ]
+    inputs = hash_inputs(prompt, config)
+    plan = manifest.value("outline:arcs", inputs)
+    if plan is not None:
+        print("Arc plan is up to date.")
+        return plan
+
+    print(f"Planning the beats of {len(arcs)} arcs...")
+    result = client.generate(prompt, config, stage="outline_plan")
+    if not result.ok:
+        print(f"Failed to plan the arcs. Error: {result.error}")
+        return None
+    try:
+        entries = json.loads(result.text)
+        if not isinstance(entries, list) or len(entries) != len(arcs):
+            raise ValueError(f"expected {len(arcs)} arcs")
+        plan = []
+        for entry in entries:
+            beats = [b.strip() for b in entry.get("beats") or [] if isinstance(b, str) and b.strip()]
+            if not beats:
+                raise ValueError("an arc has no beats")
+            title = entry.get("title") if isinstance(entry.get("title"), str) else ""
+            plan.append({"title": title.strip(), "beats": beats, "chapters": entry.get("chapters")})
+    except (ValueError, AttributeError) as e:
+        client.forget(prompt, config)
+        print(f"The arc plan returned by the API is not valid: {e}")
+        return None
+
+    counts = distribute_chapters([arc["chapters"] for arc in plan], chapter_count)
+    for arc, count in zip(plan, counts):
+        arc["chapters"] = count
+    manifest.record("outline:arcs", inputs, value=plan)
+    return plan
+
+def expand_arc(client, manifest, background, arc_text, plan, index, first_chapter, count, beats, part=1, parts=1,
+               previous_beat=None, next_beat=None):
+    """
+    Outlines the chapters of one arc, or of one part of it, from its beats.
+
+    The beats just before and after are included so that the arc (or part) starts and ends where
+    its neighbours expect it to. Every result is kept in the manifest, so a failed run only
+    repeats the requests that did not finish.
+
+    Args:
+        count (int): The number of chapters to outline.
+        beats (list): The beats these chapters cover.
+        part (int): Which part of the arc this is, counting from 1, out of `parts`.
+        previous_beat (str): The beat just before these chapters, if any.
+        next_beat (str): The beat just after these chapters, if any.
+
+    Returns:
+        list: The chapters numbered from `first_chapter`, or None if the request failed.
+    """
+    arc = plan[index]
+    last_chapter = first_chapter + count - 1
+    beat_list = "\n".join(f"- {beat}" for beat in beats)
+    if parts == 1:
+        label = f"arc {index + 1}"
+        scope = f"arc {index + 1} of {len(plan)}"
+        before, after = "previous arc ends", "next arc begins"
+        coverage = "Cover the beats of this arc in order and nothing from other arcs."
+        beat_heading = "Beats of this arc"
+    else:
+        label = f"arc {index + 1} part {part}"
+        scope = f"part {part} of {parts} of arc {index + 1} of {len(plan)}"
+        before, after = "story before this part ends", "story after this part begins"
+        coverage = "Cover the beats of this part in order and nothing that comes before or after it."
+        beat_heading = "Beats of this part"
+    neighbours = ""
+    if previous_beat:
+        neighbours += f"\n\nThe {before} with: {previous_beat}"
+    if next_beat:
+        neighbours += f"\n\nThe {after} with: {next_beat}"
+    prompt = (
+        f"Write the chapter-by-chapter outline of {scope} of a novel, covering chapters "
+        f"{first_chapter} to {last_chapter} ({count} chapters). For each chapter, provide a detailed, long paragraph "
+        f"describing the events and key developments, the point-of-view character, and the characters who appear. "
+        f"{coverage} Maintain character and item name "
+        f"coherence.\n\nStory information:\n{background}\n\nThis arc ({arc['title']}):\n{arc_text}\n\n"
+        f"{beat_heading}:\n{beat_list}{neighbours}"
+    )
+    config = {
+        "responseMimeType": "application/json",
+        "responseSchema": {"type": "ARRAY", "minItems": count, "maxItems": count, "items": CHAPTER_SCHEMA},
     }
+    node = f"outline:arc:{index + 1}" if parts == 1 else f"outline:arc:{index + 1}:{part}"
+    inputs = hash_inputs(prompt, config)
+    chapters = manifest.value(node, inputs)
+    if chapters is not None:
+        print(f"Outline of {label} is up to date.")
+        return chapters
 
+    print(f"Outlining {label} (chapters {first_chapter}-{last_chapter})...")
+    result = client.generate(prompt, config, stage="outline_arc", chapter=first_chapter)
+    if not result.ok:
+        print(f"Failed to outline {label}. Error: {result.error}")
+        return None
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(payload))
-        response.raise_for_status()  # Raise an HTTPError for bad responses (4xx or 5xx)
-
-        data = response.json()
-        
-        # Safely navigate the nested JSON structure to extract the text
-        candidate = data.get('candidates', [{}])[0]
-        content = candidate.get('content', {})
-        parts = content.get('parts', [{}])
-        completion_part = parts[0]
-        completion = completion_part.get('text')
-
-        if completion:
-            return completion
-        else:
-            # Provide a more informative error message if the expected text is not found
-            finish_reason = candidate.get('finishReason', 'unknown')
-            return f"API response did not contain text. Finish reason: {finish_reason}. Full response: {json.dumps(data)}"
-
-    except requests.exceptions.HTTPError as errh:
-        return f"HTTP Error: {errh}"
-    except requests.exceptions.ConnectionError as errc:
-        return f"Error Connecting: {errc}"
-    except requests.exceptions.Timeout as errt:
-        return f"Timeout Error: {errt}"
-    except requests.exceptions.RequestException as err:
-        return f"An unexpected error occurred: {err}"
-    except (KeyError, IndexError) as e:
-        return f"Error parsing API response: {e}. Response was: {data}"
-
-def main():
+        chapters = number_chapters(json.loads(result.text), first_chapter)
+    except ValueError as e:
+        client.forget(prompt, config)
+        print(f"The outline of {label} returned by the API is not valid: {e}")
+        return None
+    if len(chapters) != count:
+        print(f"Warning: asked for {count} chapters in {label} but got {len(chapters)}.")
+    manifest.record(node, inputs, value=chapters)
+    return chapters
+
+def generate_outline_by_arc(client, manifest, story_info, chapter_count, concurrency):
+    """
+    Outlines the book in two levels: one request plans the beats of every arc section of the
+    story info, then every arc is expanded into chapters by its own requests, all at the same
+    time. An arc of more than ARC_PART_CHAPTERS chapters is split into parts, each with its
+    share of the arc's beats and its own request. The parts are joined in order and renumbered,
+    so the result does not depend on which request finished first.
+
+    Returns:
+        list: The validated chapters, or None if a request failed.
+    """
+    background, arcs = split_arcs(story_info)
+    plan = plan_arcs(client, manifest, story_info, arcs, chapter_count)
+    if plan is None:
+        return None
+
+    # One request per part of an arc: (arc index, part, parts, first chapter, chapters, beats).
+    requests = []
+    next_chapter = 1
+    for index, arc in enumerate(plan):
+        parts = arc_parts(arc["chapters"], arc["beats"], ARC_PART_CHAPTERS)
+        for part, (count, beats) in enumerate(parts, 1):
+            requests.append((index, part, len(parts), next_chapter, count, beats))
+            next_chapter += count
+
+    def expand(position):
+        index, part, parts, first_chapter, count, beats = requests[position]
+        previous_beat = requests[position - 1][5][-1] if position > 0 else None
+        next_beat = requests[position + 1][5][0] if position < len(requests) - 1 else None
+        # Parts that share a beat are told about the beats around it instead.
+        previous_beat = previous_beat if previous_beat != beats[0] else None
+        next_beat = next_beat if next_beat != beats[-1] else None
+        return expand_arc(client, manifest, background, arcs[index], plan, index, first_chapter, count, beats,
+                          part, parts, previous_beat, next_beat)
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+        results = list(executor.map(carry_context(expand), range(len(requests))))
+    if any(chapters is None for chapters in results):
+        return None
+
+    chapters = [chapter for part_chapters in results for chapter in part_chapters]
+    for number, chapter in enumerate(chapters, 1):
+        chapter["chapter"] = number
+    return chapters
+
+def main(argv=None):
     """
     Main function to handle file processing and API call.
     """
-    # Check for the correct number of command-line arguments
-    if len(sys.argv) < 2:
-        print("Usage: python gemini_file_completer.py <input_file_path>")
-        sys.exit(1)
+    parser = argparse.ArgumentParser(description="Turn a story info file into a chapter-by-chapter outline.")
+    parser.add_argument("input_file_path", help="The story info file.")
+    parser.add_argument("--chapters", type=int, default=CHAPTER_COUNT, help="Number of chapters to outline.")
+    parser.add_argument("--by-arc", action="store_true",
+                        help="Plan the arc sections first, then outline every arc with its own concurrent request.")
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Number of arcs outlined at the same time with --by-arc.")
+    args = parser.parse_args(argv)
 
-    input_file_path = sys.argv[1]
-    
-    # Define your API key. Replace the placeholder with your actual key.
-    api_key = "Insert your Gemini key here." 
+    input_file_path = args.input_file_path
 
     try:
-        # Read the content of the input file and prepend the new instruction
         with open(input_file_path, 'r', encoding='utf-8') as file:
-            prompt_text = "Turn the following text into a 100 chapter story outline. For each chapter, provide a detailed, long paragraph describing the events and key developments. Maintain character and item name coherence.\n\n" + file.read()
-        
-        if not prompt_text.strip():
+            story_info = file.read()
+
+        if not story_info.strip():
             print("The input file is empty. No completion will be generated.")
             sys.exit(1)
 
+        by_arc = args.by_arc
+        if by_arc and not split_arcs(story_info)[1]:
+            print(f"No 'Arc' sections found in '{input_file_path}'. Outlining the book in one request.")
+            by_arc = False
+        elif by_arc and args.chapters < len(split_arcs(story_info)[1]):
+            print(f"{args.chapters} chapters are fewer than the arcs in '{input_file_path}'. "
+                  f"Outlining the book in one request.")
+            by_arc = False
+
+        # Create the output file path
+        output_file_path = completed_path(input_file_path)
+        json_output_path = outline_path(output_file_path)
+
+        # Skip the call if the outline was already built from this story info
+        manifest = BuildManifest()
+        if by_arc:
+            inputs = hash_inputs("by-arc", args.chapters, story_info)
+        else:
+            inputs = hash_inputs(outline_prompt(story_info, args.chapters))
+        if manifest.is_fresh("outline", inputs, output_file_path):
+            if not os.path.exists(json_output_path):
+                # Outlines written before the structured format get a JSON copy of their text.
+                with open(output_file_path, 'r', encoding='utf-8') as file:
+                    save_outline(json_output_path, chapters_from_text(file.read()))
+                print(f"Converted '{output_file_path}' to '{json_output_path}'.")
+            print(f"The outline in '{output_file_path}' is up to date with '{input_file_path}'. Skipping.")
+            return 0
+
         print(f"Sending content from '{input_file_path}' to the Gemini API...")
 
-        # Get the completion from the API
-        completed_text = get_gemini_completion(prompt_text, api_key)
+        client = get_client()
+        if by_arc:
+            chapters = generate_outline_by_arc(client, manifest, story_info, args.chapters, args.concurrency)
+        else:
+            chapters = generate_outline(client, story_info, args.chapters)
+        if chapters is None:
+            return 1
+        if len(chapters) != args.chapters:
+            print(f"Warning: asked for {args.chapters} chapters but the outline has {len(chapters)}.")
 
-        # Create the output file path
-        file_name, file_extension = os.path.splitext(input_file_path)
-        output_file_path = f"{file_name}_completed{file_extension}"
-        
-        # Write the completed text to a new file
-        with open(output_file_path, 'w', encoding='utf-8') as file:
-            file.write(completed_text)
-            
-        print(f"Successfully generated completion. The result has been saved to '{output_file_path}'.")
+        # Write the structured outline, plus the same outline as text with one paragraph per chapter
+        save_outline(json_output_path, chapters)
+        write_text_atomic(output_file_path, outline_text(chapters))
+        manifest.record("outline", inputs, output_file_path)
+
+        print(f"Successfully generated a {len(chapters)} chapter outline. Saved to '{json_output_path}' and '{output_file_path}'.")
+        return 0
 
     except FileNotFoundError:
         print(f"Error: The file '{input_file_path}' was not found.")
+        return 1
     except Exception as e:
         print(f"An error occurred: {e}")
+        return 1
 
 if __name__ == "__main__":
-    main()
-
+    sys.exit(main())
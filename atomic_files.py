@@ -0,0 +1,84 @@
+import os
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+class AtomicFile:
+    """
+    A text file written under a temporary name next to its destination.
+
+    Nothing appears at `path` until `commit` renames the finished file into place, so readers
+    (and resume checks) never see a partly written output. `discard` throws the file away.
+    """
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        directory = os.path.dirname(os.path.abspath(path))
+        fd, self.temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".part")
+        self.file = os.fdopen(fd, 'w', encoding=encoding)
+
+    def write(self, text):
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def commit(self):
+        self.file.close()
+        os.replace(self.temp_path, self.path)
+
+    def discard(self):
+        self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+
+def write_text_atomic(path, text, encoding='utf-8'):
+    """
+    Writes `text` to `path` through a temporary file and an atomic rename.
+    """
+    out = AtomicFile(path, encoding)
+    try:
+        out.write(text)
+    except BaseException:
+        out.discard()
+        raise
+    out.commit()
+
+
+class FileLock:
+    """
+    An exclusive lock on a file, held across processes for the duration of a `with` block.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a+')
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        else:
+            self.file.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(self.file.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    continue
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if fcntl:
+            fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+        else:
+            self.file.seek(0)
+            msvcrt.locking(self.file.fileno(), msvcrt.LK_UNLCK, 1)
+        self.file.close()
+        self.file = None
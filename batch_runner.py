@@ -0,0 +1,145 @@
+import argparse
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import DEFAULT_SLOTS_FILE, DEFAULT_STATE_FILE
+from run_pipeline import SCRIPTS_DIR, STAGE_FLAGS, add_stage_arguments
+
+
+class Book:
+    """
+    One book of a batch run.
+
+    Attributes:
+        name (str): The book's name, taken from its story info file name.
+        story_info (str): Path of the story info file it is generated from.
+        workspace (str): Directory holding the book's files.
+    """
+
+    def __init__(self, name, story_info, workspace):
+        self.name = name
+        self.story_info = story_info
+        self.workspace = workspace
+        self.status = "pending"
+        self.seconds = 0.0
+
+
+def find_books(story_dir, workspaces_dir):
+    """
+    Lists the books of a batch: one per .txt file in `story_dir`, each with a workspace of the
+    same name under `workspaces_dir`.
+    """
+    books = []
+    for file_name in sorted(os.listdir(story_dir)):
+        path = os.path.join(story_dir, file_name)
+        if file_name.endswith(".txt") and os.path.isfile(path):
+            name = os.path.splitext(file_name)[0]
+            books.append(Book(name, path, os.path.join(workspaces_dir, name)))
+    return books
+
+
+def prepare_workspace(book):
+    """
+    Creates the book's workspace and copies its story info in as story_info.txt. An unchanged
+    copy is left alone, so a rerun resumes the book where it stopped.
+    """
+    os.makedirs(book.workspace, exist_ok=True)
+    target = os.path.join(book.workspace, "story_info.txt")
+    with open(book.story_info, 'rb') as f:
+        content = f.read()
+    if os.path.exists(target):
+        with open(target, 'rb') as f:
+            if f.read() == content:
+                return
+    shutil.copyfile(book.story_info, target)
+
+
+def pipeline_args(args):
+    """Builds the run_pipeline.py arguments every book is run with."""
+    argv = ["story_info.txt", "--retries", str(args.retries), "--concurrency", str(args.concurrency)]
+    for flag in STAGE_FLAGS:
+        if getattr(args, flag):
+            argv.append("--" + flag.replace("_", "-"))
+    return argv
+
+
+def run_book(book, argv, env):
+    """
+    Runs the whole pipeline for one book in its own process, logging to pipeline.log in its
+    workspace. Books run as separate processes because every stage works in the current
+    directory, which is shared by all the threads of a process.
+    """
+    book.status = "running"
+    start = time.monotonic()
+    print(f"Starting '{book.name}'...")
+    book_env = dict(env, GEMINI_GROUP=book.name)
+    with open(os.path.join(book.workspace, "pipeline.log"), 'a', encoding='utf-8') as log:
+        result = subprocess.run([sys.executable, os.path.join(SCRIPTS_DIR, "run_pipeline.py"),
+                                 "--workspace", book.workspace] + argv,
+                                env=book_env, stdout=log, stderr=subprocess.STDOUT)
+    book.seconds = time.monotonic() - start
+    book.status = "ok" if result.returncode == 0 else "failed"
+    print(f"Finished '{book.name}': {book.status} in {book.seconds:.1f}s.")
+    return book
+
+
+def print_report(books, wall_time):
+    print("\nBatch report")
+    print("------------")
+    for book in books:
+        print(f"{book.name:<24} {book.status:<8} {book.seconds:9.1f}s  {book.workspace}")
+    print(f"{'total':<24} {'':<8} {wall_time:9.1f}s")
+
+
+def main(argv=None):
+    """
+    Generates every book in a directory of story info files, several at a time, each in its
+    own workspace, with all of their API calls drawing on one shared budget.
+    """
+    parser = argparse.ArgumentParser(description="Run the book pipeline for every story info file in a directory.")
+    parser.add_argument("story_dir", help="Directory of story info files, one .txt file per book.")
+    parser.add_argument("--workspaces", default="books",
+                        help="Directory holding one workspace per book, named after its story info file (default: books).")
+    parser.add_argument("--books", type=int, default=4, help="Number of books generated at the same time.")
+    parser.add_argument("--concurrency", type=int, default=8,
+                        help="Number of API requests in flight across all books, shared fairly between them.")
+    parser.add_argument("--rpm", type=int, default=None, help="Maximum API requests per minute per key, across all books.")
+    parser.add_argument("--tpm", type=int, default=None, help="Maximum API tokens per minute per key, across all books.")
+    parser.add_argument("--retries", type=int, default=2, help="How many times to retry a failed stage.")
+    add_stage_arguments(parser)
+    args = parser.parse_args(argv)
+
+    books = find_books(args.story_dir, args.workspaces)
+    if not books:
+        print(f"No story info files found in '{args.story_dir}'.")
+        return 1
+
+    for book in books:
+        prepare_workspace(book)
+
+    # The slot table and rate limiter state live in the workspaces directory, so every book's
+    # process draws from the same concurrency and quota budget.
+    workspaces_dir = os.path.abspath(args.workspaces)
+    env = dict(os.environ)
+    env["GEMINI_SLOTS"] = str(args.concurrency)
+    env["GEMINI_SLOTS_STATE"] = os.path.join(workspaces_dir, DEFAULT_SLOTS_FILE)
+    env["GEMINI_RATE_STATE"] = os.path.join(workspaces_dir, DEFAULT_STATE_FILE)
+    if args.rpm:
+        env["GEMINI_RPM"] = str(args.rpm)
+    if args.tpm:
+        env["GEMINI_TPM"] = str(args.tpm)
+
+    book_argv = pipeline_args(args)
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=max(1, args.books)) as executor:
+        list(executor.map(lambda book: run_book(book, book_argv, env), books))
+    print_report(books, time.monotonic() - start)
+    return 0 if all(book.status == "ok" for book in books) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,122 @@
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from metrics import load_records, print_summary, summarize
+from mock_gemini_server import MockConfig, api_base, start_server
+from run_pipeline import SCRIPTS_DIR, add_stage_arguments, build_stages, print_report, run_stages
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def peak_rss_mb():
+    """Returns the peak resident set size of this process in MB, or None where it is unavailable."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes elsewhere.
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def main(argv=None):
+    """
+    Runs the book pipeline end to end against a local mock of the Gemini API and reports wall
+    time, API calls per second and peak memory. Everything happens in a temporary workspace,
+    so the benchmark needs no API key and leaves the working directory untouched.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the pipeline offline against mock_gemini_server.py.")
+    parser.add_argument("--chapters", type=int, default=100, help="Number of chapters in the mocked outline.")
+    parser.add_argument("--latency", default="lognormal:0.05,0.5",
+                        help="Mock latency: fixed:S, uniform:A,B or lognormal:MEDIAN,SIGMA (seconds).")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429.")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Fraction of requests answered with 503.")
+    parser.add_argument("--rate-empty", type=float, default=0.0, help="Fraction of responses with no text.")
+    parser.add_argument("--tokens-per-second", type=float, default=None,
+                        help="Mock generation speed; makes latency grow with the length of the response.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--keys", type=int, default=4, help="Number of fake API keys to spread calls over.")
+    add_stage_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of chapters enhanced at the same time.")
+    parser.add_argument("--hedge", type=float, default=0.0,
+                        help="Largest fraction of calls that may be hedged (GEMINI_HEDGE); 0 turns hedging off.")
+    parser.add_argument("--retries", type=int, default=2, help="How many times to retry a failed stage.")
+    parser.add_argument("--cache", action="store_true", help="Leave the response cache enabled.")
+    parser.add_argument("--keep", action="store_true", help="Keep the workspace instead of deleting it.")
+    parser.add_argument("--verbose", action="store_true", help="Show the stages' output instead of logging it.")
+    parser.set_defaults(story_info="story_info.txt")
+    args = parser.parse_args(argv)
+
+    config = MockConfig(args.latency, args.rate_429, args.rate_empty, seed=args.seed,
+                        tokens_per_second=args.tokens_per_second, rate_5xx=args.rate_5xx)
+    server = start_server(config)
+    workspace = tempfile.mkdtemp(prefix="gemini_bench_")
+    shutil.copy(os.path.join(SCRIPTS_DIR, "story_info.txt"), os.path.join(workspace, "story_info.txt"))
+    os.environ.update({
+        "GEMINI_API_BASE": api_base(server),
+        "GEMINI_API_KEYS": ",".join(f"bench-key-{i}" for i in range(1, args.keys + 1)),
+        "GEMINI_CACHE": "1" if args.cache else "0",
+        "GEMINI_CACHE_DIR": os.path.join(workspace, ".gemini_cache"),
+        "GEMINI_METRICS": os.path.join(workspace, "gemini_metrics.jsonl"),
+        "GEMINI_RATE_STATE": os.path.join(workspace, ".gemini_rate_state.json"),
+        "GEMINI_HEDGE": str(args.hedge),
+    })
+
+    original_dir = os.getcwd()
+    original_stdout = sys.stdout
+    # The real pipeline's stages, less the blurb, which no benchmark option affects.
+    stages = [stage for stage in build_stages(args, args.chapters) if stage.name != "blurb"]
+    log = None
+    os.chdir(workspace)
+    try:
+        if not args.verbose:
+            log = open("pipeline.log", 'w', encoding='utf-8')
+            sys.stdout = log
+        tracemalloc.start()
+        start = time.monotonic()
+        success = run_stages(stages, args.retries, retry_delay=0)
+        wall_time = time.monotonic() - start
+        _, traced_peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    finally:
+        sys.stdout = original_stdout
+        if log:
+            log.close()
+        os.chdir(original_dir)
+        server.shutdown()
+
+    stats = server.stats.snapshot()
+    print_report(stages, wall_time)
+    print("\nBenchmark")
+    print("---------")
+    print(f"chapters         {args.chapters}")
+    print(f"mock latency     {args.latency}")
+    print(f"API requests     {stats['requests']} ({stats['rate_limited']} rate limited, "
+          f"{stats['server_errors']} server errors, {stats['empty']} empty)")
+    print(f"wall time        {wall_time:.2f}s")
+    print(f"calls/sec        {stats['requests'] / wall_time:.2f}")
+    print(f"peak traced mem  {traced_peak / (1024 * 1024):.1f} MB")
+    rss = peak_rss_mb()
+    if rss is not None:
+        print(f"peak RSS         {rss:.1f} MB")
+
+    metrics_path = os.path.join(workspace, "gemini_metrics.jsonl")
+    if os.path.exists(metrics_path):
+        print()
+        print_summary(summarize(load_records(metrics_path)))
+
+    if args.keep:
+        print(f"\nWorkspace kept at {workspace}")
+    else:
+        shutil.rmtree(workspace, ignore_errors=True)
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
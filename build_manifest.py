@@ -0,0 +1,116 @@
+import hashlib
+import json
+import os
+import threading
+
+from atomic_files import FileLock
+
+DEFAULT_MANIFEST = ".build_manifest.json"
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def hash_file(path):
+    """
+    Returns the SHA-256 of a file's contents, or None if the file does not exist.
+    """
+    try:
+        with open(path, 'rb') as f:
+            return hashlib.sha256(f.read()).hexdigest()
+    except FileNotFoundError:
+        return None
+
+
+def hash_inputs(*parts):
+    """
+    Combines the inputs of a build step (texts, hashes or None) into one hash.
+    """
+    return hash_text(json.dumps(list(parts)))
+
+
+class BuildManifest:
+    """
+    Records what every pipeline output was built from, so that a rerun only rebuilds stale outputs.
+
+    Each node (for example "chapter:12" or "title:12") stores the hash of its inputs. A node is
+    fresh when its output file still exists and its inputs hash is unchanged. Downstream nodes
+    take the content hash of their upstream outputs as inputs, so an edit anywhere (a summary in
+    the outline, or a chapter file changed by hand) makes exactly the dependent nodes stale.
+
+    Outputs that already exist but were never recorded, such as books generated before the
+    manifest was introduced, are adopted as fresh the first time they are checked.
+
+    Writes merge into the file on disk under a file lock, so several scripts can share one manifest.
+    """
+
+    def __init__(self, path=DEFAULT_MANIFEST):
+        self.path = path
+        self.lock = threading.Lock()
+        self.nodes = self.load()
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("nodes", {})
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def is_fresh(self, node, inputs, output_path=None):
+        """
+        Checks whether a node's output is up to date with its inputs.
+
+        Args:
+            node (str): The node name.
+            inputs (str): The hash of the node's current inputs.
+            output_path (str): The node's output file, if it has one.
+
+        Returns:
+            bool: True if the node does not need to be rebuilt.
+        """
+        if output_path and not os.path.exists(output_path):
+            return False
+        with self.lock:
+            entry = self.nodes.get(node)
+        if entry is None:
+            if output_path:
+                self.record(node, inputs, output_path)
+                return True
+            return False
+        return entry["inputs"] == inputs
+
+    def value(self, node, inputs):
+        """
+        Returns the value recorded for a node if its inputs are unchanged, otherwise None.
+        """
+        with self.lock:
+            entry = self.nodes.get(node)
+        if entry is None or entry["inputs"] != inputs:
+            return None
+        return entry.get("value")
+
+    def record(self, node, inputs, output_path=None, value=None):
+        """
+        Records that a node was built from `inputs`.
+
+        Args:
+            node (str): The node name.
+            inputs (str): The hash of the inputs the output was built from.
+            output_path (str): The node's output file, if it has one.
+            value: A small JSON-serializable result to keep with the node (for example a title).
+        """
+        entry = {"inputs": inputs}
+        if output_path:
+            entry["output"] = hash_file(output_path)
+        if value is not None:
+            entry["value"] = value
+
+        with self.lock, FileLock(self.path + ".lock"):
+            nodes = self.load()
+            nodes[node] = entry
+            temp_path = f"{self.path}.{os.getpid()}.tmp"
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump({"nodes": nodes}, f, indent=1, sort_keys=True)
+            os.replace(temp_path, self.path)
+            self.nodes = nodes
@@ -0,0 +1,99 @@
+import re
+
+SECTION_WORDS = 350
+DIALOGUE_WORDS = 80
+SCENE_BREAK = re.compile(r"^\s*(?:[*#~]\s*){1,5}$|^\s*[-_=]{3,}\s*$")
+DIALOGUE_START = ('"', "'", '“', '‘', '—')
+QUOTE = re.compile(r'["“]([^"“”]+)["”]')
+# Words that carry sight, sound, smell, taste and touch. Their share of a section's narration
+# is a cheap measure of how descriptive it already is.
+SENSORY_WORDS = frozenset("""
+    amber ash bitter blaze bleak blinding bright brittle bronze buzz chill clatter cold cool creak crimson
+    crisp crunch damp dark dim drip dusty earthy echo faint flicker fragrant glare gleam glint glimmer glitter
+    glow gold golden gray green grey grit groan gust haze heat heavy hiss hot hum icy laden loud metallic mist
+    moist murmur musk musty pale pungent red rattle reek rough rumble rustle salt salty scent shadow shimmer
+    shiver shriek silence silver slick smell smoke smoky smooth soft sour sparkle splash stale steam sticky
+    stench sting stink sweat sweet tang tangy taste thick thud thunder tingle velvet warm wet whisper white
+    wind woody
+""".split())
+
+
+def word_count(text):
+    return len(text.split())
+
+
+def is_dialogue(line):
+    return line.lstrip().startswith(DIALOGUE_START)
+
+
+def split_sections(text, target_words=SECTION_WORDS, dialogue_words=DIALOGUE_WORDS):
+    """
+    Splits a chapter into sections that can be rewritten one at a time.
+
+    A scene break ends a section and forms a section of its own, and so does a run of dialogue
+    paragraphs of at least `dialogue_words` words. Otherwise consecutive paragraphs are grouped
+    until a section holds at least `target_words` words. Sections keep their surrounding blank
+    lines, so "".join(sections) gives back the chapter exactly.
+
+    Returns:
+        list: The section texts, in order.
+    """
+    # Runs of lines of one kind ("break", "dialogue" or "narrative"); blank lines join the run before them.
+    runs = []
+    for line in text.splitlines(keepends=True):
+        if not line.strip():
+            kind = runs[-1][0] if runs else "narrative"
+        elif SCENE_BREAK.match(line):
+            kind = "break"
+        else:
+            kind = "dialogue" if is_dialogue(line) else "narrative"
+        if runs and runs[-1][0] == kind and (kind != "break" or not line.strip()):
+            runs[-1][1].append(line)
+        else:
+            runs.append((kind, [line]))
+
+    sections = []
+    current = []
+    for kind, lines in runs:
+        if kind == "break" or (kind == "dialogue" and word_count("".join(lines)) >= dialogue_words):
+            if current:
+                sections.append("".join(current))
+                current = []
+            sections.append("".join(lines))
+            continue
+        for line in lines:
+            current.append(line)
+            if word_count("".join(current)) >= target_words:
+                sections.append("".join(current))
+                current = []
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def is_passthrough(section):
+    """True for sections that are left as they are: blank lines, scene breaks and dialogue only."""
+    paragraphs = [line.strip() for line in section.splitlines() if line.strip()]
+    if not paragraphs or all(SCENE_BREAK.match(p) for p in paragraphs):
+        return True
+    return all(is_dialogue(p) for p in paragraphs)
+
+
+def descriptive_density(section):
+    """Returns the number of sensory words per 100 words of narration (dialogue left out)."""
+    words = re.findall(r"[a-z']+", QUOTE.sub(" ", section).lower())
+    if not words:
+        return 0.0
+    return 100 * sum(word in SENSORY_WORDS for word in words) / len(words)
+
+
+def missing_dialogue(original, rewritten):
+    """
+    Lists the lines of dialogue in `original` that do not appear in `rewritten`, comparing
+    words only so that changes to punctuation or quote marks do not count.
+    """
+    def words(text):
+        return " ".join(re.findall(r"[\w']+", text.lower()))
+
+    rewritten_words = words(rewritten)
+    return [quote for quote in QUOTE.findall(original) if words(quote) and words(quote) not in rewritten_words]
@@ -0,0 +1,572 @@
+import hashlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from atomic_files import AtomicFile, write_text_atomic
+from hedging import hedge_from_env
+from metrics import metrics_from_env
+from rate_limiter import limiter_from_env, slots_from_env
+from response_cache import cache_from_env
+from retry_policy import RETRY_STATUSES, RetryPolicy, parse_retry_after
+from thread_context import carry_context
+
+API_BASE = "https://generativelanguage.googleapis.com/v1beta"
+DEFAULT_MODEL = "gemini-2.5-flash-preview-05-20"
+KEYS_FILE = "run.txt"
+
+
+class Completion:
+    """
+    The result of a single call to the Gemini API.
+
+    Attributes:
+        text (str): The generated text, or None if the call failed.
+        error (str): A description of the failure, or None on success.
+        finish_reason (str): The finish reason reported by the model.
+        usage (dict): The usageMetadata block of the response, if any.
+        status_code (int): The HTTP status of the last attempt, if any.
+        latency (float): Wall time in seconds spent on the call, retries included.
+        retries (int): How many times the request was retried.
+        key_id (str): Fingerprint of the API key used for the last attempt.
+        cached (bool): True if the result was served from the response cache.
+        first_byte (float): Seconds until the first chunk arrived, for streamed calls.
+        hedged (bool): True if a duplicate request was raced against the call.
+    """
+
+    def __init__(self, text=None, error=None, finish_reason=None, usage=None,
+                 status_code=None, latency=0.0, retries=0, key_id=None, cached=False,
+                 first_byte=None, hedged=False):
+        self.text = text
+        self.error = error
+        self.finish_reason = finish_reason
+        self.usage = usage or {}
+        self.status_code = status_code
+        self.latency = latency
+        self.retries = retries
+        self.key_id = key_id
+        self.cached = cached
+        self.first_byte = first_byte
+        self.hedged = hedged
+
+    @property
+    def ok(self):
+        return self.error is None and bool(self.text)
+
+    def __repr__(self):
+        if self.ok:
+            return f"Completion(ok, {len(self.text)} chars, {self.latency:.2f}s)"
+        return f"Completion(error={self.error!r})"
+
+
+class RequestCancelled(Exception):
+    """Raised inside a request whose result is no longer wanted."""
+
+
+def estimate_tokens(text):
+    """
+    Roughly estimates the number of tokens in a piece of text (about four characters per token).
+    """
+    return max(1, len(text) // 4)
+
+
+def key_fingerprint(api_key):
+    """
+    Returns a short, stable identifier for an API key that is safe to write to disk or logs.
+    """
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+
+
+def parse_response(data):
+    """
+    Extracts the text, finish reason and usage metadata from a generateContent response.
+
+    Args:
+        data (dict): The decoded JSON body returned by the API.
+
+    Returns:
+        tuple: (text, finish_reason, usage). text is None if the response has no text.
+    """
+    candidates = data.get('candidates') or [{}]
+    candidate = candidates[0]
+    parts = candidate.get('content', {}).get('parts') or [{}]
+    text = "".join(part.get('text', '') for part in parts) or None
+    return text, candidate.get('finishReason', 'unknown'), data.get('usageMetadata', {})
+
+
+def load_api_keys(path=KEYS_FILE):
+    """
+    Reads the API keys to use.
+
+    Keys come from the comma-separated GEMINI_API_KEYS environment variable if it is set,
+    otherwise from the "API keys:" block of run.txt (one key per line, ending at the first
+    blank line). run.txt is looked up in the working directory, then next to this module.
+
+    Returns:
+        list: The API keys, in file order.
+    """
+    env_keys = os.environ.get("GEMINI_API_KEYS")
+    if env_keys:
+        return [key.strip() for key in env_keys.split(',') if key.strip()]
+
+    candidates = [path, os.path.join(os.path.dirname(os.path.abspath(__file__)), path)]
+    for candidate in candidates:
+        if not os.path.exists(candidate):
+            continue
+        keys = []
+        in_keys = False
+        with open(candidate, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if line.lower().startswith("api keys"):
+                    in_keys = True
+                elif in_keys and not line:
+                    break
+                elif in_keys:
+                    keys.append(line)
+        if keys:
+            return keys
+    return []
+
+
+class KeyPool:
+    """
+    Spreads requests over several API keys.
+
+    Each request gets the key with the fewest requests in flight, with ties broken in
+    round-robin order. A key that is rate limited is cooled down and skipped until its
+    cooldown expires; if every key is cooling down, `acquire` waits for the first to recover.
+    """
+
+    def __init__(self, api_keys):
+        self.keys = list(dict.fromkeys(api_keys))
+        if not self.keys:
+            raise ValueError(f"No API keys configured. Add them to {KEYS_FILE} or set GEMINI_API_KEYS.")
+        self.in_flight = {key: 0 for key in self.keys}
+        self.cooldown_until = {key: 0.0 for key in self.keys}
+        self.next_index = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Picks a key for one request and marks it as in flight. Pair every call with `release`.
+
+        Returns:
+            str: The API key.
+        """
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                order = self.keys[self.next_index:] + self.keys[:self.next_index]
+                available = [key for key in order if self.cooldown_until[key] <= now]
+                if available:
+                    key = min(available, key=lambda k: self.in_flight[k])
+                    self.in_flight[key] += 1
+                    self.next_index = (self.keys.index(key) + 1) % len(self.keys)
+                    return key
+                wait = min(self.cooldown_until.values()) - now
+            time.sleep(wait)
+
+    def release(self, key):
+        with self.lock:
+            self.in_flight[key] -= 1
+
+    def cool_down(self, key, seconds):
+        """Stops handing out `key` for the next `seconds` seconds."""
+        with self.lock:
+            self.cooldown_until[key] = max(self.cooldown_until[key], time.monotonic() + seconds)
+
+    def __len__(self):
+        return len(self.keys)
+
+
+class GeminiClient:
+    """
+    A pooled HTTP client for the Gemini generateContent endpoint.
+
+    One client keeps a requests.Session with keep-alive connections, so repeated calls
+    reuse the same TCP/TLS connection instead of opening a new one per request. Requests
+    are spread over every configured API key. The client is safe to share between threads.
+    """
+
+    def __init__(self, api_keys, model=DEFAULT_MODEL, api_base=API_BASE, connect_timeout=10,
+                 read_timeout=300, max_retries=5, backoff_factor=1, pool_size=16, rate_limiter=None,
+                 cache=None, metrics=None, slots=None, retry_policy=None, hedge=None):
+        """
+        Args:
+            api_keys (list): Your API keys for the Google Generative Language API. A single
+                key may also be passed as a string.
+            model (str): The model name used to build the endpoint URL.
+            api_base (str): The base URL of the API.
+            connect_timeout (float): Seconds to wait for a connection to be established.
+            read_timeout (float): Seconds to wait for the server to send a response.
+            max_retries (int): Maximum number of attempts per call, unless retry_policy is given.
+            backoff_factor (float): Backoff ceiling of the first retry in seconds, unless retry_policy
+                is given.
+            pool_size (int): Maximum number of pooled connections kept alive.
+            rate_limiter (RateLimiter): Optional limiter consulted before every request. Its
+                budget is tracked separately for each API key and model.
+            cache (ResponseCache): Optional cache of successful responses, keyed by the model URL,
+                prompt and generation config.
+            metrics (MetricsLog): Optional log that receives one record per call.
+            slots (SharedSlots): Optional limit on requests in flight, shared with other processes.
+            retry_policy (RetryPolicy): When and how often failed calls are retried, with the retry
+                budget of the run. Defaults to a policy built from max_retries and backoff_factor.
+            hedge (HedgePolicy): Optional policy for racing a duplicate request against slow calls.
+        """
+        if isinstance(api_keys, str):
+            api_keys = [api_keys]
+        self.keys = KeyPool(api_keys)
+        self.model = model
+        self.url = f"{api_base}/models/{model}:generateContent"
+        self.stream_url = f"{api_base}/models/{model}:streamGenerateContent?alt=sse"
+        self.timeout = (connect_timeout, read_timeout)
+        self.retry_policy = retry_policy or RetryPolicy(max_attempts=max_retries, base=backoff_factor)
+        self.rate_limiter = rate_limiter
+        self.cache = cache
+        self.metrics = metrics
+        self.slots = slots
+        self.hedge = hedge
+        self.hedge_executor = ThreadPoolExecutor(max_workers=2 * pool_size) if hedge else None
+        self.pool_size = pool_size
+        self.pool_lock = threading.Lock()
+
+        self.session = requests.Session()
+        self.mount_adapter(pool_size)
+        self.session.headers.update({'Content-Type': 'application/json'})
+        self.key_headers = {key: {'X-goog-api-key': key} for key in self.keys.keys}
+        self.key_ids = {key: key_fingerprint(key) for key in self.keys.keys}
+
+    def mount_adapter(self, pool_size):
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def grow_pool(self, pool_size):
+        """
+        Makes room for at least `pool_size` requests in flight, for a caller that runs more
+        threads than the client was created for. Requests already running finish on the old pool.
+        """
+        with self.pool_lock:
+            if pool_size <= self.pool_size:
+                return
+            self.pool_size = pool_size
+            self.mount_adapter(pool_size)
+            if self.hedge_executor is not None:
+                old_executor = self.hedge_executor
+                self.hedge_executor = ThreadPoolExecutor(max_workers=2 * pool_size)
+                old_executor.shutdown(wait=False)
+
+    def rate_scope(self, key):
+        return f"{self.key_ids[key]}:{self.model}"
+
+    def build_payload(self, prompt, generation_config=None):
+        payload = {"contents": [{"parts": [{"text": prompt}]}]}
+        if generation_config:
+            payload["generationConfig"] = generation_config
+        return payload
+
+    def read_stream(self, response, out, start, label=None, cancel=None):
+        """
+        Reads a server-sent-events response, writing each text chunk to `out` as it arrives.
+        Progress is printed every few seconds under `label`, if one is given. If the `cancel`
+        event gets set, the connection is closed, which stops the generation, and
+        RequestCancelled is raised.
+
+        Returns:
+            tuple: (data, first_byte). data has the shape of a generateContent response holding
+            the full text; first_byte is the number of seconds until the first chunk arrived.
+        """
+        response.encoding = 'utf-8'
+        pieces = []
+        words = 0
+        finish_reason = None
+        usage = {}
+        first_byte = None
+        last_report = time.monotonic()
+        for line in response.iter_lines(decode_unicode=True):
+            if cancel is not None and cancel.is_set():
+                response.close()
+                raise RequestCancelled()
+            if not line or not line.startswith("data:"):
+                continue
+            chunk = json.loads(line[5:])
+            if first_byte is None:
+                first_byte = time.monotonic() - start
+            text, reason, chunk_usage = parse_response(chunk)
+            if text:
+                pieces.append(text)
+                out.write(text)
+                out.flush()
+                words += len(text.split())
+            if reason != 'unknown':
+                finish_reason = reason
+            usage = chunk_usage or usage
+            if label and time.monotonic() - last_report >= 5:
+                print(f"Streaming '{label}': {words} words received...")
+                last_report = time.monotonic()
+
+        candidate = {"content": {"parts": [{"text": "".join(pieces)}]}}
+        if finish_reason:
+            candidate["finishReason"] = finish_reason
+        return {"candidates": [candidate], "usageMetadata": usage}, first_byte
+
+    def generate(self, prompt, generation_config=None, stream_to=None, stage=None, chapter=None):
+        """
+        Sends a text prompt to the Gemini API and returns the generated completion.
+        Rate limiting, server errors, timeouts and dropped connections are retried under the
+        client's RetryPolicy, with jittered exponential backoff or the server's Retry-After; a
+        rate-limited key is cooled down and the call moves to another key if one is available.
+        Identical requests are answered from the cache.
+
+        Args:
+            prompt (str): The text content to send to the model.
+            generation_config (dict): Optional generationConfig block for the request.
+            stream_to (str): If given, the streaming endpoint is used and the text is appended to a
+                temporary file next to this path as it arrives. The file is renamed to `stream_to`
+                only once the stream completes successfully.
+            stage (str): Name of the pipeline stage making the call, for the metrics log.
+            chapter (int): The chapter the call is for, for the metrics log.
+
+        Returns:
+            Completion: The result of the call. Check `ok` before using `text`.
+        """
+        if self.hedge and not stream_to:
+            completion = self.hedged_request(prompt, generation_config, stage or "default")
+            if completion.ok and not completion.cached:
+                self.hedge.record(stage or "default", completion.latency)
+        else:
+            completion = self.request(prompt, generation_config, stream_to)
+        if self.metrics:
+            self.metrics.record_call(completion, prompt, self.model, stage, chapter)
+        return completion
+
+    def forget(self, prompt, generation_config=None):
+        """
+        Drops the cached response to a request, so the next identical request reaches the API.
+        Used when a response arrived intact but turned out to be unusable, such as structured
+        output that fails validation.
+        """
+        if self.cache:
+            self.cache.delete(self.cache.key(self.url, prompt, generation_config))
+
+    def hedged_request(self, prompt, generation_config, stage):
+        """
+        Performs a call, racing a duplicate against it if it is slow.
+
+        If the call has not returned after the stage's usual tail latency (see HedgePolicy) and
+        the hedge budget allows it, the same request is sent again, on the least busy key. The
+        first successful response wins and the other request is cancelled. Both run on the
+        streaming endpoint, so the loser's connection can be closed mid-generation.
+        """
+        delay = self.hedge.delay(stage)
+        if delay is None:
+            return self.request(prompt, generation_config)
+
+        start = time.monotonic()
+        cancels = {}
+        primary_cancel = threading.Event()
+        primary = self.hedge_executor.submit(carry_context(self.request), prompt, generation_config, None, primary_cancel)
+        cancels[primary] = primary_cancel
+        done, _ = wait([primary], timeout=delay)
+        if done or not self.hedge.allow_hedge():
+            return primary.result()
+
+        hedge_cancel = threading.Event()
+        cancels[self.hedge_executor.submit(carry_context(self.request), prompt, generation_config, None, hedge_cancel)] = hedge_cancel
+        pending = set(cancels)
+        winner = None
+        failure = None
+        while pending and winner is None:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                completion = future.result()
+                if completion.ok and winner is None:
+                    winner = completion
+                elif failure is None:
+                    failure = completion
+        for future in pending:
+            cancels[future].set()
+
+        completion = winner or failure
+        completion.hedged = True
+        completion.latency = time.monotonic() - start
+        return completion
+
+    def request(self, prompt, generation_config=None, stream_to=None, cancel=None):
+        """
+        Performs the call behind `generate`, without logging it.
+
+        With a `cancel` event, the streaming endpoint is used and the text is collected in
+        memory, so that setting the event aborts the call at the next chunk.
+        """
+        start = time.monotonic()
+        cache_key = None
+        if self.cache:
+            cache_key = self.cache.key(self.url, prompt, generation_config)
+            entry = self.cache.get(cache_key)
+            if entry is not None:
+                if stream_to:
+                    write_text_atomic(stream_to, entry['text'])
+                return Completion(text=entry['text'], finish_reason=entry.get('finish_reason'),
+                                  usage=entry.get('usage'), latency=time.monotonic() - start, cached=True)
+
+        body = json.dumps(self.build_payload(prompt, generation_config))
+        status_code = None
+        # Reserve room for the prompt plus a reply of similar size; corrected from usageMetadata below.
+        reserved_tokens = estimate_tokens(prompt) * 2
+
+        streaming = bool(stream_to) or cancel is not None
+        policy = self.retry_policy
+        policy.record_request()
+        retry_wait = 0
+        for attempt in range(policy.max_attempts):
+            if retry_wait:
+                time.sleep(retry_wait)
+                retry_wait = 0
+            if cancel is not None and cancel.is_set():
+                return Completion(error="Cancelled", status_code=status_code, latency=time.monotonic() - start,
+                                  retries=attempt)
+            key = self.keys.acquire()
+            out = None
+            first_byte = None
+            slot_id = None
+            try:
+                if self.rate_limiter:
+                    self.rate_limiter.acquire(reserved_tokens, self.rate_scope(key))
+                if self.slots:
+                    slot_id = self.slots.acquire()
+                response = self.session.post(self.stream_url if streaming else self.url, data=body,
+                                             headers=self.key_headers[key], timeout=self.timeout,
+                                             stream=streaming)
+                status_code = response.status_code
+                if status_code in RETRY_STATUSES and policy.allow_retry(attempt):
+                    wait_time = policy.backoff(attempt, parse_retry_after(response.headers.get("Retry-After")))
+                    response.close()
+                    if status_code == 429:
+                        # Only this key is limited: cool it down and carry on with another one.
+                        print(f"Rate limit hit on key {self.key_ids[key]}. Cooling it down for {wait_time:.1f} seconds...")
+                        self.keys.cool_down(key, wait_time)
+                    else:
+                        print(f"Server error {status_code}. Retrying in {wait_time:.1f} seconds...")
+                        retry_wait = wait_time
+                    continue
+                response.raise_for_status()
+                if stream_to:
+                    out = AtomicFile(stream_to)
+                    data, first_byte = self.read_stream(response, out, start, os.path.basename(stream_to), cancel)
+                elif streaming:
+                    data, first_byte = self.read_stream(response, io.StringIO(), start, cancel=cancel)
+                else:
+                    data = response.json()
+            except RequestCancelled:
+                return Completion(error="Cancelled", status_code=status_code, latency=time.monotonic() - start,
+                                  retries=attempt, key_id=self.key_ids[key])
+            except requests.exceptions.HTTPError as errh:
+                error = f"HTTP Error: {errh}"
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout,
+                    requests.exceptions.ChunkedEncodingError) as e:
+                if isinstance(e, requests.exceptions.Timeout):
+                    error = f"Timeout Error: {e}"
+                elif isinstance(e, requests.exceptions.ConnectionError):
+                    error = f"Error Connecting: {e}"
+                else:
+                    error = f"Connection broken: {e}"
+                if policy.allow_retry(attempt):
+                    retry_wait = policy.backoff(attempt)
+                    print(f"{error}. Retrying in {retry_wait:.1f} seconds...")
+                    continue
+            except requests.exceptions.RequestException as err:
+                error = f"An unexpected error occurred: {err}"
+            except ValueError as e:
+                error = f"Error parsing API response: {e}"
+            else:
+                text, finish_reason, usage = parse_response(data)
+                if self.rate_limiter and 'totalTokenCount' in usage:
+                    self.rate_limiter.adjust(usage['totalTokenCount'] - reserved_tokens, self.rate_scope(key))
+                error = None
+                if not text:
+                    error = f"API response did not contain text. Finish reason: {finish_reason}. Full response: {json.dumps(data)}"
+                else:
+                    if out:
+                        out.commit()
+                        out = None
+                    if cache_key:
+                        self.cache.put(cache_key, {'url': self.url, 'text': text,
+                                                   'finish_reason': finish_reason, 'usage': usage})
+                return Completion(text=text, error=error, finish_reason=finish_reason, usage=usage,
+                                  status_code=status_code, latency=time.monotonic() - start,
+                                  retries=attempt, key_id=self.key_ids[key], first_byte=first_byte)
+            finally:
+                if out:
+                    out.discard()
+                if slot_id:
+                    self.slots.release(slot_id)
+                self.keys.release(key)
+            return Completion(error=error, status_code=status_code, latency=time.monotonic() - start,
+                              retries=attempt, key_id=self.key_ids[key])
+
+        return Completion(error=f"Failed after {policy.max_attempts} attempts.",
+                          status_code=status_code, latency=time.monotonic() - start,
+                          retries=policy.max_attempts - 1)
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(api_keys=None, **kwargs):
+    """
+    Returns a shared GeminiClient for the given keys, creating it on first use.
+
+    Unless a rate_limiter, cache, metrics log, slots limit or hedge policy is passed, the client uses the
+    shared limiter configured through the GEMINI_RPM / GEMINI_TPM environment variables, if any,
+    the response cache configured through GEMINI_CACHE / GEMINI_CACHE_DIR, the metrics log
+    configured through GEMINI_METRICS, the shared concurrency limit configured through
+    GEMINI_SLOTS and request hedging configured through GEMINI_HEDGE. GEMINI_API_BASE points the client at another endpoint, such as
+    mock_gemini_server.py.
+
+    Args:
+        api_keys (list): The API keys to spread requests over. Defaults to load_api_keys().
+        **kwargs: Extra GeminiClient options, used when the client is first created. Later
+            callers, such as a stage of run_pipeline.py started after another, can still raise
+            `pool_size`; any other option they pass is ignored with a warning.
+
+    Returns:
+        GeminiClient: The shared client.
+    """
+    if api_keys is None:
+        api_keys = load_api_keys()
+    elif isinstance(api_keys, str):
+        api_keys = [api_keys]
+    cache_key = tuple(api_keys)
+    with _clients_lock:
+        client = _clients.get(cache_key)
+        if client is None:
+            if 'rate_limiter' not in kwargs:
+                kwargs['rate_limiter'] = limiter_from_env()
+            if 'cache' not in kwargs:
+                kwargs['cache'] = cache_from_env()
+            if 'metrics' not in kwargs:
+                kwargs['metrics'] = metrics_from_env()
+            if 'slots' not in kwargs:
+                kwargs['slots'] = slots_from_env()
+            if 'hedge' not in kwargs:
+                kwargs['hedge'] = hedge_from_env()
+            if 'api_base' not in kwargs and os.environ.get("GEMINI_API_BASE"):
+                kwargs['api_base'] = os.environ["GEMINI_API_BASE"]
+            client = GeminiClient(api_keys, **kwargs)
+            _clients[cache_key] = client
+            return client
+    if 'pool_size' in kwargs:
+        client.grow_pool(kwargs.pop('pool_size'))
+    ignored = sorted(name for name, value in kwargs.items() if value is not None)
+    if ignored:
+        print(f"Warning: the shared API client already exists; ignoring {', '.join(ignored)}.")
+    return client
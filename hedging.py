@@ -0,0 +1,75 @@
+import os
+import threading
+from collections import deque
+
+from metrics import percentile
+
+
+class HedgePolicy:
+    """
+    Decides when a slow call gets a duplicate ("hedge") request racing it.
+
+    Latencies of successful calls are kept per stage, since a title and a chapter take very
+    different times. Once a stage has `min_samples` of them, a call of that stage that has not
+    returned after the stage's `quantile` latency is hedged, as long as hedges stay under
+    `max_rate` of all calls, which bounds the extra cost. The policy is safe to share between
+    threads.
+    """
+
+    def __init__(self, max_rate=0.1, quantile=0.9, min_samples=20, window=200):
+        """
+        Args:
+            max_rate (float): Largest fraction of calls that may be hedged.
+            quantile (float): Latency quantile after which a call is hedged.
+            min_samples (int): Calls of a stage observed before any of its calls is hedged.
+            window (int): Number of recent latencies kept per stage.
+        """
+        self.max_rate = max_rate
+        self.quantile = quantile
+        self.min_samples = min_samples
+        self.window = window
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.calls = 0
+        self.hedges = 0
+
+    def delay(self, stage):
+        """
+        Counts a new call and returns how long to wait before hedging it.
+
+        Returns:
+            float: Seconds, or None if the stage has too few observed latencies yet.
+        """
+        with self.lock:
+            self.calls += 1
+            samples = self.latencies.get(stage)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            return percentile(list(samples), self.quantile)
+
+    def allow_hedge(self):
+        """Spends one hedge if the hedge rate stays within `max_rate`."""
+        with self.lock:
+            if self.hedges + 1 > self.max_rate * self.calls:
+                return False
+            self.hedges += 1
+            return True
+
+    def record(self, stage, latency):
+        """Adds the latency of a successful, uncached call of `stage`."""
+        with self.lock:
+            self.latencies.setdefault(stage, deque(maxlen=self.window)).append(latency)
+
+
+def hedge_from_env():
+    """
+    Builds the hedge policy configured by GEMINI_HEDGE, the largest fraction of calls that may
+    be hedged (for example GEMINI_HEDGE=0.1).
+
+    Returns:
+        HedgePolicy: The policy, or None if hedging is off (the default).
+    """
+    max_rate = float(os.environ.get("GEMINI_HEDGE", 0) or 0)
+    if max_rate <= 0:
+        return None
+    return HedgePolicy(max_rate)
@@ -0,0 +1,244 @@
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+from build_manifest import hash_file
+from thread_context import carry_context
+
+DEFAULT_QUEUE_FILE = ".job_queue.sqlite3"
+LEASE_SECONDS = 600
+MAX_ATTEMPTS = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    stage TEXT NOT NULL,
+    chapter INTEGER NOT NULL,
+    inputs TEXT NOT NULL,
+    status TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    lease_owner TEXT,
+    lease_expires REAL,
+    output_hash TEXT,
+    error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (stage, chapter)
+)
+"""
+
+
+class Job:
+    """
+    A leased unit of work.
+
+    Attributes:
+        stage (str): The pipeline stage, e.g. "enhance".
+        chapter (int): The chapter the job is for.
+        inputs (str): The hash of the inputs the job was queued with.
+        attempts (int): How many times the job has been leased, this lease included.
+        owner (str): The worker holding the lease.
+    """
+
+    def __init__(self, stage, chapter, inputs, attempts, owner):
+        self.stage = stage
+        self.chapter = chapter
+        self.inputs = inputs
+        self.attempts = attempts
+        self.owner = owner
+
+    def __repr__(self):
+        return f"Job({self.stage}:{self.chapter}, attempt {self.attempts})"
+
+
+def worker_id():
+    """Names the calling thread uniquely across the processes sharing a queue."""
+    return f"{os.getpid()}:{threading.get_ident()}"
+
+
+class JobQueue:
+    """
+    A durable queue of per-chapter jobs, kept in a SQLite file next to the book.
+
+    Each job records its stage, chapter, input hash, status ("pending", "leased", "done" or
+    "failed"), attempt count and the hash of the output it produced. Workers take jobs with
+    `claim`, which leases one for `lease_seconds` inside a write transaction, so several threads
+    and processes can drain the same queue without two of them making the same call. While a
+    job runs, `drain` renews its lease every third of `lease_seconds`, so a slow job keeps it. A
+    worker that crashes stops renewing; once its lease expires the job is claimed again.
+    """
+
+    def __init__(self, path=DEFAULT_QUEUE_FILE, lease_seconds=LEASE_SECONDS, max_attempts=MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self.transaction() as conn:
+            conn.execute(SCHEMA)
+
+    @contextmanager
+    def transaction(self):
+        """Yields a connection inside a write transaction, committed on success."""
+        conn = sqlite3.connect(self.path, timeout=60, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+
+    def enqueue(self, stage, chapter, inputs, output_path=None):
+        """
+        Adds a job, or resets it to pending if its inputs changed, it failed in an earlier run,
+        or it is done but its output file is gone or no longer matches the recorded hash. A job
+        that is done and intact, or leased by a live worker, is left alone.
+        """
+        now = time.time()
+        output_hash = hash_file(output_path) if output_path and os.path.exists(output_path) else None
+        with self.transaction() as conn:
+            row = conn.execute("SELECT inputs, status, output_hash, lease_expires FROM jobs WHERE stage = ? AND chapter = ?",
+                               (stage, chapter)).fetchone()
+            if row is None:
+                conn.execute("INSERT INTO jobs (stage, chapter, inputs, status, updated) VALUES (?, ?, ?, 'pending', ?)",
+                             (stage, chapter, inputs, now))
+            elif row[1] == "leased" and row[3] >= now:
+                return
+            elif (row[0] != inputs or row[1] == "failed"
+                  or (row[1] == "done" and output_path and row[2] != output_hash)):
+                conn.execute("UPDATE jobs SET inputs = ?, status = 'pending', attempts = 0, lease_owner = NULL, "
+                             "lease_expires = NULL, error = NULL, updated = ? WHERE stage = ? AND chapter = ?",
+                             (inputs, now, stage, chapter))
+
+    def claim(self, stage, owner=None, chapters=None):
+        """
+        Leases the lowest-numbered job of `stage` that is pending or whose lease has expired.
+
+        Args:
+            stage (str): The stage to take a job from.
+            owner (str): The worker taking the job; defaults to the calling thread.
+            chapters (iterable): If given, only these chapters are considered.
+
+        Returns:
+            Job: The leased job, or None if there is nothing to take right now.
+        """
+        owner = owner or worker_id()
+        now = time.time()
+        wanted = None if chapters is None else set(chapters)
+        with self.transaction() as conn:
+            rows = conn.execute(
+                "SELECT chapter, inputs, attempts FROM jobs WHERE stage = ? AND "
+                "(status = 'pending' OR (status = 'leased' AND lease_expires < ?)) ORDER BY chapter",
+                (stage, now)).fetchall()
+            for chapter, inputs, attempts in rows:
+                if wanted is not None and chapter not in wanted:
+                    continue
+                if attempts >= self.max_attempts:
+                    # The last lease expired without an answer: give up on the job.
+                    conn.execute("UPDATE jobs SET status = 'failed', error = 'lease expired', lease_owner = NULL, "
+                                 "updated = ? WHERE stage = ? AND chapter = ?", (now, stage, chapter))
+                    continue
+                conn.execute("UPDATE jobs SET status = 'leased', attempts = attempts + 1, lease_owner = ?, "
+                             "lease_expires = ?, updated = ? WHERE stage = ? AND chapter = ?",
+                             (owner, now + self.lease_seconds, now, stage, chapter))
+                return Job(stage, chapter, inputs, attempts + 1, owner)
+        return None
+
+    def renew(self, job):
+        """
+        Extends a job's lease by `lease_seconds` from now.
+
+        Returns:
+            bool: False if the lease had already been lost to another worker.
+        """
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ?, updated = ? WHERE stage = ? AND chapter = ? AND lease_owner = ? "
+                "AND status = 'leased'",
+                (time.time() + self.lease_seconds, time.time(), job.stage, job.chapter, job.owner))
+            return cursor.rowcount == 1
+
+    def heartbeat(self, job, stop):
+        """Renews the job's lease every third of `lease_seconds` until `stop` is set or the lease is lost."""
+        while not stop.wait(self.lease_seconds / 3):
+            if not self.renew(job):
+                print(f"Lost the lease on {job}; another worker has taken it over.")
+                return
+
+    def complete(self, job, output_path=None):
+        """
+        Marks a job done, recording the hash of its output file.
+
+        Returns:
+            bool: False if the lease had already been lost to another worker.
+        """
+        output_hash = hash_file(output_path) if output_path else None
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'done', output_hash = ?, error = NULL, lease_owner = NULL, "
+                "lease_expires = NULL, updated = ? WHERE stage = ? AND chapter = ? AND lease_owner = ? "
+                "AND status = 'leased'", (output_hash, time.time(), job.stage, job.chapter, job.owner))
+            return cursor.rowcount == 1
+
+    def fail(self, job, error=None):
+        """
+        Gives a job back after a failed attempt. It is queued again until it has been tried
+        `max_attempts` times, after which it stays failed until it is enqueued again.
+        """
+        status = "failed" if job.attempts >= self.max_attempts else "pending"
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, lease_owner = NULL, lease_expires = NULL, updated = ? "
+                "WHERE stage = ? AND chapter = ? AND lease_owner = ? AND status = 'leased'",
+                (status, error, time.time(), job.stage, job.chapter, job.owner))
+
+    def statuses(self, stage, chapters=None):
+        """
+        Returns:
+            dict: chapter -> status for the jobs of `stage`, limited to `chapters` if given.
+        """
+        with self.transaction() as conn:
+            rows = conn.execute("SELECT chapter, status FROM jobs WHERE stage = ?", (stage,)).fetchall()
+        wanted = None if chapters is None else set(chapters)
+        return {chapter: status for chapter, status in rows if wanted is None or chapter in wanted}
+
+    def drain(self, stage, run, chapters=None, poll_seconds=0.5):
+        """
+        Claims and runs jobs of `stage` until none is left to run, then waits for the jobs other
+        workers hold so the stage is finished when it returns. Leases that expire while waiting
+        (their worker died) are taken over.
+
+        Args:
+            stage (str): The stage to work on.
+            run (callable): Called with each Job; returns the job's output file on success and
+                None on failure.
+            chapters (iterable): If given, only these chapters are worked on.
+
+        Returns:
+            bool: True if every job ended up done.
+        """
+        chapters = None if chapters is None else list(chapters)
+        while True:
+            job = self.claim(stage, chapters=chapters)
+            if job is not None:
+                stop = threading.Event()
+                threading.Thread(target=carry_context(self.heartbeat), args=(job, stop), daemon=True).start()
+                try:
+                    output_path = run(job)
+                except Exception as e:
+                    self.fail(job, str(e))
+                    raise
+                finally:
+                    stop.set()
+                if not output_path:
+                    self.fail(job, "attempt failed")
+                elif not self.complete(job, output_path):
+                    print(f"{job} finished after its lease was taken over; the other worker's result stands.")
+                continue
+            statuses = self.statuses(stage, chapters).values()
+            if not any(status in ("pending", "leased") for status in statuses):
+                return all(status == "done" for status in statuses)
+            time.sleep(poll_seconds)
@@ -0,0 +1,162 @@
+import json
+import math
+import os
+import sys
+import threading
+import time
+
+DEFAULT_METRICS_FILE = "gemini_metrics.jsonl"
+
+
+class MetricsLog:
+    """
+    Appends one JSON record per API call to a metrics file.
+
+    Each record is written with a single append, so several threads or processes can log to
+    the same file without interleaving lines.
+    """
+
+    def __init__(self, path=DEFAULT_METRICS_FILE):
+        self.path = path
+        self.lock = threading.Lock()
+
+    def write(self, record):
+        line = json.dumps(record) + "\n"
+        with self.lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line)
+
+    def record_call(self, completion, prompt, model, stage=None, chapter=None):
+        """
+        Logs the outcome of one API call.
+
+        Args:
+            completion (Completion): The result returned by the client.
+            prompt (str): The prompt that was sent.
+            model (str): The model name.
+            stage (str): The pipeline stage that made the call, e.g. "chapter" or "title".
+            chapter (int): The chapter the call was for, if any.
+        """
+        usage = completion.usage or {}
+        self.write({
+            "time": time.time(),
+            "stage": stage,
+            "chapter": chapter,
+            "model": model,
+            "key": completion.key_id,
+            "prompt_bytes": len(prompt.encode('utf-8')),
+            "prompt_tokens": usage.get("promptTokenCount"),
+            "output_tokens": usage.get("candidatesTokenCount"),
+            "total_tokens": usage.get("totalTokenCount"),
+            "latency": round(completion.latency, 4),
+            "first_byte": round(completion.first_byte, 4) if completion.first_byte is not None else None,
+            "retries": completion.retries,
+            "status": completion.status_code,
+            "cached": completion.cached,
+            "hedged": completion.hedged,
+            "ok": completion.ok,
+            "error": completion.error[:200] if completion.error else None,
+        })
+
+
+def metrics_from_env():
+    """
+    Builds the metrics log configured by the environment.
+
+    Calls are logged to gemini_metrics.jsonl by default; GEMINI_METRICS sets another path and
+    GEMINI_METRICS=0 turns logging off.
+
+    Returns:
+        MetricsLog: The log, or None if logging is disabled.
+    """
+    path = os.environ.get("GEMINI_METRICS", DEFAULT_METRICS_FILE)
+    if path in ("", "0"):
+        return None
+    return MetricsLog(path)
+
+
+def percentile(values, fraction):
+    """Returns the nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, math.ceil(fraction * len(ordered)) - 1))
+    return ordered[index]
+
+
+def load_records(path):
+    records = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+    return records
+
+
+def summarize(records):
+    """
+    Groups call records by stage.
+
+    Returns:
+        dict: stage -> {calls, errors, cached, retries, p50, p95, total_tokens, avg_tokens}.
+        Latency percentiles only count calls that reached the API.
+    """
+    stages = {}
+    for record in records:
+        stages.setdefault(record.get("stage") or "unlabelled", []).append(record)
+
+    summary = {}
+    for stage, stage_records in stages.items():
+        live = [r for r in stage_records if not r.get("cached")]
+        latencies = [r["latency"] for r in live if r.get("latency") is not None]
+        tokens = [r["total_tokens"] for r in stage_records if r.get("total_tokens") is not None]
+        summary[stage] = {
+            "calls": len(stage_records),
+            "errors": sum(1 for r in stage_records if not r.get("ok")),
+            "cached": len(stage_records) - len(live),
+            "retries": sum(r.get("retries") or 0 for r in stage_records),
+            "p50": percentile(latencies, 0.50),
+            "p95": percentile(latencies, 0.95),
+            "total_latency": sum(latencies),
+            "total_tokens": sum(tokens),
+            "avg_tokens": sum(tokens) / len(tokens) if tokens else None,
+        }
+    return summary
+
+
+def print_summary(summary):
+    """
+    Prints the per-stage table built by summarize(), busiest stage first.
+    """
+    def seconds(value):
+        return f"{value:.2f}s" if value is not None else "-"
+
+    print(f"{'stage':<15} {'calls':>6} {'errors':>6} {'cached':>6} {'retries':>7} {'p50':>8} {'p95':>8} {'busy':>9} {'tokens':>10} {'avg tok':>8}")
+    for stage, s in sorted(summary.items(), key=lambda item: -item[1]["total_latency"]):
+        avg_tokens = f"{s['avg_tokens']:.0f}" if s["avg_tokens"] is not None else "-"
+        print(f"{stage:<15} {s['calls']:>6} {s['errors']:>6} {s['cached']:>6} {s['retries']:>7} "
+              f"{seconds(s['p50']):>8} {seconds(s['p95']):>8} {s['total_latency']:>8.1f}s {s['total_tokens']:>10} {avg_tokens:>8}")
+
+
+def main():
+    """
+    Prints per-stage latency and token statistics from a metrics file.
+    """
+    path = sys.argv[1] if len(sys.argv) > 1 else os.environ.get("GEMINI_METRICS", DEFAULT_METRICS_FILE)
+    if not os.path.exists(path):
+        print(f"Error: The metrics file '{path}' was not found.")
+        sys.exit(1)
+
+    summary = summarize(load_records(path))
+    if not summary:
+        print(f"No API calls recorded in '{path}'.")
+        return
+    print_summary(summary)
+
+if __name__ == "__main__":
+    main()
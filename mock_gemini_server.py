@@ -0,0 +1,327 @@
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+WORDS = (
+    "ship hull signal drift quiet engine orbit station ledger cargo static pilot frontier "
+    "beacon salvage contract halo divide shadow ember corridor console patrol vessel "
+    "whisper chrome rust lantern horizon vector debt broker relay thruster archive glass "
+    "storm pulse harbor orbit dust echo warden circuit oath faint bright cold heavy slow"
+).split()
+NAMES = ["Axel", "Mira", "Oren", "Vell", "Tamsin", "Korr", "Ilya", "Brenn"]
+
+
+class MockConfig:
+    """
+    Behaviour of the mock server.
+
+    Attributes:
+        latency (str): Latency distribution of a whole response: "fixed:S", "uniform:A,B" or
+            "lognormal:MEDIAN,SIGMA" (seconds).
+        rate_429 (float): Probability that a request is answered with HTTP 429.
+        rate_empty (float): Probability that a response has no text (finishReason SAFETY).
+        outline_chapters (int): Number of paragraphs in outline responses; by default the
+            chapter count requested by the prompt.
+        seed (int): Seed mixed into every random choice, so runs are reproducible.
+        tokens_per_second (float): Generation speed; when set, every output token adds
+            1 / tokens_per_second seconds on top of the sampled latency.
+        rate_5xx (float): Probability that a request is answered with HTTP 503.
+    """
+
+    def __init__(self, latency="fixed:0", rate_429=0.0, rate_empty=0.0, outline_chapters=None, seed=0,
+                 tokens_per_second=None, rate_5xx=0.0):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.rate_empty = rate_empty
+        self.outline_chapters = outline_chapters
+        self.seed = seed
+        self.tokens_per_second = tokens_per_second
+        self.rate_5xx = rate_5xx
+
+    def sample_latency(self, rng):
+        kind, _, params = self.latency.partition(":")
+        values = [float(v) for v in params.split(",") if v]
+        if kind == "uniform":
+            return rng.uniform(values[0], values[1])
+        if kind == "lognormal":
+            return values[0] * rng.lognormvariate(0, values[1])
+        return values[0] if values else 0.0
+
+
+class MockStats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "streamed": 0, "rate_limited": 0, "server_errors": 0, "empty": 0,
+                       "prompt_chars": 0, "output_chars": 0}
+
+    def add(self, **counts):
+        with self.lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counts)
+
+
+def fake_sentence(rng, words):
+    chosen = [rng.choice(WORDS) for _ in range(words)]
+    chosen[0] = rng.choice(NAMES)
+    return " ".join(chosen).capitalize() + "."
+
+
+def fake_paragraph(rng, words):
+    sentences = []
+    while words > 0:
+        length = min(words, rng.randint(8, 18))
+        sentences.append(fake_sentence(rng, length))
+        words -= length
+    return " ".join(sentences)
+
+
+def fake_text(rng, words, paragraph_words=90):
+    paragraphs = []
+    while words > 0:
+        length = min(words, paragraph_words)
+        paragraphs.append(fake_paragraph(rng, length))
+        words -= length
+    return "\n\n".join(paragraphs)
+
+
+def fake_title(rng):
+    return " ".join(word.capitalize() for word in rng.sample(WORDS, rng.randint(2, 5)))
+
+
+def fake_json(rng, schema, array_items=3, index=0, name=None):
+    """
+    Builds a value matching a (subset of an) OpenAPI response schema. Enum strings inside an
+    array take the enum values in order, so that e.g. one entry per requested file comes back.
+    """
+    kind = schema.get("type", "string").lower()
+    if "enum" in schema:
+        return schema["enum"][index % len(schema["enum"])]
+    if kind == "object":
+        return {key: fake_json(rng, prop, array_items, index, key) for key, prop in schema.get("properties", {}).items()}
+    if kind == "array":
+        # `array_items` sizes the outermost array only; nested lists get a few entries.
+        count = schema.get("minItems", array_items)
+        return [fake_json(rng, schema.get("items", {}), 3, i) for i in range(int(count))]
+    if kind == "integer":
+        if name == "chapter":
+            return index + 1
+        return rng.randint(1, 100)
+    if kind == "number":
+        return round(rng.uniform(0, 100), 2)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if name == "title":
+        return fake_title(rng)
+    if name in ("pov", "name") or name is None:
+        # Bare strings are list entries, such as the characters of a chapter.
+        return rng.choice(NAMES)
+    if name == "summary":
+        return fake_paragraph(rng, rng.randint(60, 110))
+    if name == "chapter_text":
+        # A whole chapter written together with its continuity note.
+        return fake_text(rng, rng.randint(1000, 1500))
+    if name == "text":
+        # Rewritten passages, such as expanded paragraphs of a chapter.
+        return fake_paragraph(rng, rng.randint(120, 200))
+    return fake_paragraph(rng, rng.randint(10, 40))
+
+
+def response_text(rng, prompt, generation_config, config):
+    """
+    Produces deterministic text shaped like what the real model returns for each pipeline prompt.
+    """
+    if generation_config.get("responseMimeType") == "application/json" and generation_config.get("responseSchema"):
+        match = re.search(r"(\d+)[- ]chapter", prompt)
+        items = config.outline_chapters or (int(match.group(1)) if match else 3)
+        return json.dumps(fake_json(rng, generation_config["responseSchema"], items))
+
+    outline = re.search(r"(\d+) chapter story outline", prompt)
+    if outline:
+        chapters = config.outline_chapters or int(outline.group(1))
+        return "\n\n".join(fake_paragraph(rng, rng.randint(60, 110)) for _ in range(chapters))
+
+    if "title" in prompt.lower() and "only the title" in prompt.lower():
+        return fake_title(rng)
+
+    if "concise summary" in prompt.lower():
+        summary = fake_text(rng, rng.randint(150, 300))
+        if "'Characters and items:'" in prompt:
+            names = rng.sample(NAMES, rng.randint(2, 5))
+            summary += "\n\nCharacters and items:\n" + "\n".join(f"- {name}: {fake_sentence(rng, 10)}" for name in names)
+        return summary
+
+    word_range = re.search(r"(\d+)\s*(?:-|and)\s*(\d+) words", prompt)
+    if word_range:
+        words = rng.randint(int(word_range.group(1)), int(word_range.group(2)))
+    else:
+        words = min(4000, max(80, int(len(prompt.split()) * 1.3)))
+    max_tokens = generation_config.get("maxOutputTokens")
+    if max_tokens:
+        words = min(words, int(max_tokens * 0.75))
+    return fake_text(rng, words)
+
+
+def finish_reason(text, generation_config):
+    max_tokens = generation_config.get("maxOutputTokens")
+    return "MAX_TOKENS" if max_tokens and len(text.split()) >= int(max_tokens * 0.75) else "STOP"
+
+
+class MockGeminiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, delayed ACKs add ~40 ms per call.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def handle(self):
+        try:
+            super().handle()
+        except ConnectionError:
+            # Clients close pooled connections whenever they like; that is not a server error.
+            pass
+
+    def send_json(self, status, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/") == "/stats":
+            self.send_json(200, self.server.stats.snapshot())
+        else:
+            self.send_json(404, {"error": {"code": 404, "message": "Not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            request = json.loads(self.rfile.read(length))
+            prompt = "".join(part.get("text", "") for part in request["contents"][0]["parts"])
+        except (ValueError, KeyError, IndexError):
+            self.send_json(400, {"error": {"code": 400, "message": "Invalid request"}})
+            return
+        if ":generateContent" not in self.path and ":streamGenerateContent" not in self.path:
+            self.send_json(404, {"error": {"code": 404, "message": "Not found"}})
+            return
+
+        config = self.server.config
+        streaming = ":streamGenerateContent" in self.path
+        seed = int(hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:12], 16) ^ config.seed
+        rng = random.Random(seed)
+        # Faults are drawn from an unseeded generator, so a retried request can succeed.
+        fault = random.random()
+        self.server.stats.add(requests=1, streamed=int(streaming), prompt_chars=len(prompt))
+
+        if fault < config.rate_429:
+            self.server.stats.add(rate_limited=1)
+            self.send_json(429, {"error": {"code": 429, "message": "Resource has been exhausted", "status": "RESOURCE_EXHAUSTED"}})
+            return
+        if fault < config.rate_429 + config.rate_5xx:
+            self.server.stats.add(server_errors=1)
+            self.send_json(503, {"error": {"code": 503, "message": "The model is overloaded. Please try again later.",
+                                           "status": "UNAVAILABLE"}})
+            return
+
+        # Like faults, latency differs between identical requests, as it does on the real API.
+        latency = config.sample_latency(random)
+        generation_config = request.get("generationConfig", {})
+        if fault < config.rate_429 + config.rate_5xx + config.rate_empty:
+            self.server.stats.add(empty=1)
+            usage = {"promptTokenCount": len(prompt) // 4, "totalTokenCount": len(prompt) // 4}
+            events = [{"candidates": [{"finishReason": "SAFETY"}], "usageMetadata": usage}]
+        else:
+            text = response_text(rng, prompt, generation_config, config)
+            self.server.stats.add(output_chars=len(text))
+            usage = {"promptTokenCount": len(prompt) // 4, "candidatesTokenCount": len(text) // 4,
+                     "totalTokenCount": (len(prompt) + len(text)) // 4}
+            if config.tokens_per_second:
+                latency += usage["candidatesTokenCount"] / config.tokens_per_second
+            chunk_size = 400 if streaming else max(1, len(text))
+            pieces = [text[i:i + chunk_size] for i in range(0, len(text), chunk_size)] or [""]
+            events = [{"candidates": [{"content": {"parts": [{"text": piece}], "role": "model"}}]} for piece in pieces]
+            events[-1]["candidates"][0]["finishReason"] = finish_reason(text, generation_config)
+            events[-1]["usageMetadata"] = usage
+
+        if not streaming:
+            time.sleep(latency)
+            self.send_json(200, events[0])
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        time.sleep(latency * 0.2)
+        for event in events:
+            data = f"data: {json.dumps(event)}\r\n\r\n".encode('utf-8')
+            self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+            self.wfile.flush()
+            time.sleep(latency * 0.8 / len(events))
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_server(config=None, host="127.0.0.1", port=0):
+    """
+    Starts the mock server on a background thread.
+
+    Returns:
+        ThreadingHTTPServer: The running server; its `stats` attribute counts requests and
+        `server_port` holds the bound port. Call shutdown() to stop it.
+    """
+    server = ThreadingHTTPServer((host, port), MockGeminiHandler)
+    server.daemon_threads = True
+    server.config = config or MockConfig()
+    server.stats = MockStats()
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def api_base(server):
+    """Returns the value to put in GEMINI_API_BASE to talk to a running mock server."""
+    return f"http://{server.server_address[0]}:{server.server_port}/v1beta"
+
+
+def main():
+    """
+    Runs a local stand-in for the Gemini generateContent API until interrupted.
+    """
+    parser = argparse.ArgumentParser(description="Serve a local mock of the Gemini generateContent API.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", default="lognormal:0.5,0.4",
+                        help="fixed:S, uniform:A,B or lognormal:MEDIAN,SIGMA (seconds).")
+    parser.add_argument("--rate-429", type=float, default=0.0, help="Fraction of requests answered with 429.")
+    parser.add_argument("--rate-5xx", type=float, default=0.0, help="Fraction of requests answered with 503.")
+    parser.add_argument("--rate-empty", type=float, default=0.0, help="Fraction of responses with no text.")
+    parser.add_argument("--outline-chapters", type=int, default=None,
+                        help="Number of chapters in outline responses (default: as requested by the prompt).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--tokens-per-second", type=float, default=None,
+                        help="Generation speed; makes latency grow with the length of the response.")
+    args = parser.parse_args()
+
+    config = MockConfig(args.latency, args.rate_429, args.rate_empty, args.outline_chapters, args.seed,
+                        args.tokens_per_second, args.rate_5xx)
+    server = start_server(config, args.host, args.port)
+    print(f"Mock Gemini API listening. Point the scripts at it with:\n  GEMINI_API_BASE={api_base(server)}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+import re
+
+from gemini_client import estimate_tokens
+
+CHARS_PER_TOKEN = 4
+TRIM_MARKER = "[...]"
+SENTENCE_END = re.compile(r"[.!?…][\"'”’)\]]*(?=\s|$)")
+
+
+def cut_head(text, max_chars):
+    """Returns the longest start of `text` within `max_chars` that ends on a sentence, else on a word."""
+    if len(text) <= max_chars:
+        return text
+    ends = [m.end() for m in SENTENCE_END.finditer(text, 0, max_chars + 1) if m.end() <= max_chars]
+    if ends:
+        return text[:ends[-1]]
+    space = text.rfind(" ", 0, max_chars)
+    return text[:space] if space > 0 else text[:max_chars]
+
+
+def cut_tail(text, max_chars):
+    """Returns the longest end of `text` within `max_chars` that starts on a sentence, else on a word."""
+    if len(text) <= max_chars:
+        return text
+    first = len(text) - max_chars
+    for m in SENTENCE_END.finditer(text, max(0, first - 4)):
+        start = len(text) - len(text[m.end():].lstrip())
+        if start >= first:
+            return text[start:]
+    space = text.find(" ", first)
+    return text[space + 1:] if space >= 0 else text[first:]
+
+
+def trim_text(text, max_tokens, keep="head"):
+    """
+    Shortens text to about `max_tokens` tokens, cutting at sentence boundaries.
+
+    Args:
+        text (str): The text to shorten.
+        max_tokens (int): The target size, as counted by estimate_tokens.
+        keep (str): Which part to keep: "head" (the beginning), "tail" (the end) or "ends"
+            (the beginning and the end, dropping the middle).
+
+    Returns:
+        str: The text unchanged if it fits, otherwise the kept part with "[...]" where text was
+        removed, or "" if `max_tokens` is too small to keep anything.
+    """
+    text = text.strip()
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    max_chars = max_tokens * CHARS_PER_TOKEN - len(TRIM_MARKER) - 2
+    if max_chars <= 0:
+        return ""
+    if keep == "tail":
+        return f"{TRIM_MARKER}\n{cut_tail(text, max_chars)}"
+    if keep == "ends":
+        head = cut_head(text, max_chars // 2)
+        tail = cut_tail(text, max_chars - len(head))
+        return f"{head}\n{TRIM_MARKER}\n{tail}"
+    return f"{cut_head(text, max_chars)}\n{TRIM_MARKER}"
+
+
+class Section:
+    """
+    One variable part of a prompt.
+
+    Attributes:
+        name (str): A label for the section.
+        text (str): The section's text.
+        priority (int): Sections with lower priority are trimmed first.
+        min_tokens (int): Size the section is never trimmed below (0 lets it be dropped).
+        keep (str): Which part of the text survives trimming; see trim_text.
+    """
+
+    def __init__(self, name, text, priority=0, min_tokens=0, keep="head"):
+        self.name = name
+        self.text = text
+        self.priority = priority
+        self.min_tokens = min_tokens
+        self.keep = keep
+
+
+def fit_sections(sections, max_tokens):
+    """
+    Trims sections, lowest priority first, until together they fit in `max_tokens`.
+
+    Each section is shortened only as much as needed, and never below its min_tokens, so a
+    request that already fits is left untouched. Sections trimmed to nothing come back as "".
+
+    Returns:
+        list: The section texts, in the order given.
+    """
+    texts = [section.text.strip() for section in sections]
+    over = sum(estimate_tokens(text) for text in texts) - max_tokens
+    for index in sorted(range(len(sections)), key=lambda i: sections[i].priority):
+        if over <= 0:
+            break
+        section = sections[index]
+        current = estimate_tokens(texts[index])
+        target = max(section.min_tokens, current - over)
+        if target >= current:
+            continue
+        texts[index] = trim_text(texts[index], target, section.keep) if target > 0 else ""
+        over -= current - estimate_tokens(texts[index])
+    return texts
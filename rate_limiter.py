@@ -0,0 +1,306 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+from atomic_files import FileLock
+
+DEFAULT_STATE_FILE = ".gemini_rate_state.json"
+DEFAULT_SLOTS_FILE = ".gemini_slots.json"
+
+
+class TokenBucket:
+    """
+    A token bucket that refills continuously at a fixed rate per minute.
+
+    The bucket may go negative when a caller consumes more than it reserved, in which
+    case later callers wait until the debt has been refilled.
+    """
+
+    def __init__(self, per_minute, now, level=None):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity if level is None else min(self.capacity, level)
+        self.updated = now
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + max(0.0, now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """Returns how many seconds to wait before `amount` can be taken from the bucket."""
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate
+
+
+class RateLimiter:
+    """
+    Keeps a stream of API calls under a requests-per-minute and tokens-per-minute budget.
+
+    Callers reserve a request and an estimated number of tokens before each call with
+    `acquire`, which blocks until the budget allows it, and may correct the token estimate
+    afterwards with `adjust`. Each scope (for example one API key and model) has its own
+    pair of buckets. The limiter is safe to share between threads.
+    """
+
+    clock = staticmethod(time.monotonic)
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Args:
+            requests_per_minute (int): Maximum requests per minute, or None for no limit.
+            tokens_per_minute (int): Maximum tokens per minute, or None for no limit.
+        """
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.lock = threading.Lock()
+        self.scopes = {}
+
+    @contextmanager
+    def locked_scopes(self):
+        """Yields the scope table while holding the limiter's lock."""
+        with self.lock:
+            yield self.scopes
+
+    def buckets(self, scopes, scope, now):
+        if scope not in scopes:
+            scopes[scope] = {
+                "requests": TokenBucket(self.requests_per_minute, now) if self.requests_per_minute else None,
+                "tokens": TokenBucket(self.tokens_per_minute, now) if self.tokens_per_minute else None,
+            }
+        return scopes[scope]["requests"], scopes[scope]["tokens"]
+
+    def acquire(self, tokens=0, scope="default"):
+        """
+        Blocks until one request and `tokens` tokens fit in the scope's budget, then reserves them.
+
+        Returns:
+            float: The number of seconds spent waiting.
+        """
+        if not self.requests_per_minute and not self.tokens_per_minute:
+            return 0.0
+        waited = 0.0
+        while True:
+            with self.locked_scopes() as scopes:
+                now = self.clock()
+                requests, token_bucket = self.buckets(scopes, scope, now)
+                wait = 0.0
+                if requests:
+                    requests.refill(now)
+                    wait = max(wait, requests.wait_time(1))
+                if token_bucket:
+                    token_bucket.refill(now)
+                    wait = max(wait, token_bucket.wait_time(tokens))
+                if wait <= 0:
+                    if requests:
+                        requests.level -= 1
+                    if token_bucket:
+                        token_bucket.level -= tokens
+                    return waited
+            time.sleep(wait)
+            waited += wait
+
+    def adjust(self, tokens, scope="default"):
+        """
+        Charges (or refunds, if negative) tokens after a call, once the real usage is known.
+        """
+        if not self.tokens_per_minute or not tokens:
+            return
+        with self.locked_scopes() as scopes:
+            now = self.clock()
+            token_bucket = self.buckets(scopes, scope, now)[1]
+            token_bucket.refill(now)
+            token_bucket.level = min(token_bucket.capacity, token_bucket.level - tokens)
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    A RateLimiter whose buckets live in a local state file, so that every script running
+    on the machine draws from the same per-key, per-model budget.
+
+    The state file is read and rewritten under an exclusive file lock on each call.
+    """
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, state_path=DEFAULT_STATE_FILE, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Args:
+            state_path (str): Path of the JSON file holding the shared bucket levels.
+            requests_per_minute (int): Maximum requests per minute per scope, or None for no limit.
+            tokens_per_minute (int): Maximum tokens per minute per scope, or None for no limit.
+        """
+        super().__init__(requests_per_minute, tokens_per_minute)
+        self.state_path = state_path
+        self.lock_path = state_path + ".lock"
+
+    def load(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+        scopes = {}
+        for scope, saved in state.items():
+            scopes[scope] = {"requests": None, "tokens": None}
+            for name, per_minute in (("requests", self.requests_per_minute), ("tokens", self.tokens_per_minute)):
+                if per_minute and saved.get(name):
+                    level, updated = saved[name]
+                    scopes[scope][name] = TokenBucket(per_minute, updated, level)
+                elif per_minute:
+                    scopes[scope][name] = TokenBucket(per_minute, self.clock())
+        return scopes
+
+    def save(self, scopes):
+        state = {}
+        for scope, buckets in scopes.items():
+            state[scope] = {name: [bucket.level, bucket.updated] if bucket else None
+                            for name, bucket in buckets.items()}
+        temp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(temp_path, self.state_path)
+
+    @contextmanager
+    def locked_scopes(self):
+        with self.lock, FileLock(self.lock_path):
+            scopes = self.load()
+            yield scopes
+            self.save(scopes)
+
+
+def limiter_from_env():
+    """
+    Builds the shared limiter configured by the GEMINI_RPM, GEMINI_TPM and GEMINI_RATE_STATE
+    environment variables.
+
+    Returns:
+        SharedRateLimiter: The limiter, or None if neither GEMINI_RPM nor GEMINI_TPM is set.
+    """
+    requests_per_minute = int(os.environ.get("GEMINI_RPM", 0)) or None
+    tokens_per_minute = int(os.environ.get("GEMINI_TPM", 0)) or None
+    if not requests_per_minute and not tokens_per_minute:
+        return None
+    return SharedRateLimiter(os.environ.get("GEMINI_RATE_STATE", DEFAULT_STATE_FILE),
+                             requests_per_minute, tokens_per_minute)
+
+
+class SharedSlots:
+    """
+    A limit on the number of API requests in flight across every process on the machine,
+    shared fairly between groups (for example the books of a batch run).
+
+    Each request holds a slot for its duration. While requests of several groups are waiting,
+    each group may hold at most its fair share of the slots, so a book with many chapters in
+    flight cannot starve the others; a group may use more than its share only while no other
+    group is waiting. Holders and waiters are kept in a state file under an exclusive file
+    lock. A slot held longer than `lease_seconds` (its process died) is freed.
+    """
+
+    clock = staticmethod(time.time)
+
+    def __init__(self, limit, state_path=DEFAULT_SLOTS_FILE, group="default", lease_seconds=900, poll_seconds=0.05):
+        """
+        Args:
+            limit (int): Maximum number of requests in flight.
+            state_path (str): Path of the JSON file holding the slot table.
+            group (str): The group the requests of this process belong to.
+            lease_seconds (float): How long a slot may be held before it is assumed abandoned.
+            poll_seconds (float): How often a waiting request checks for a free slot.
+        """
+        self.limit = limit
+        self.state_path = state_path
+        self.lock_path = state_path + ".lock"
+        self.group = group
+        self.lease_seconds = lease_seconds
+        self.poll_seconds = poll_seconds
+
+    def load(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, ValueError):
+            state = {}
+        return state.get("holders", {}), state.get("waiting", {})
+
+    def save(self, holders, waiting):
+        temp_path = f"{self.state_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({"holders": holders, "waiting": waiting}, f)
+        os.replace(temp_path, self.state_path)
+
+    def try_take(self, slot_id, holders, waiting, now):
+        """Takes a slot for `slot_id` if the limit and the fair share allow it."""
+        for table, max_age in ((holders, self.lease_seconds), (waiting, max(1.0, self.poll_seconds * 20))):
+            for other, (_, seen) in list(table.items()):
+                if now - seen > max_age:
+                    del table[other]
+        if len(holders) >= self.limit:
+            return False
+        groups = {group for group, _ in holders.values()} | {group for group, _ in waiting.values()}
+        share = max(1, self.limit // max(1, len(groups)))
+        held = {}
+        for group, _ in holders.values():
+            held[group] = held.get(group, 0) + 1
+        others_waiting = any(group != self.group and held.get(group, 0) < share
+                             for other, (group, _) in waiting.items() if other != slot_id)
+        if held.get(self.group, 0) >= share and others_waiting:
+            return False
+        waiting.pop(slot_id, None)
+        holders[slot_id] = [self.group, now]
+        return True
+
+    def acquire(self):
+        """
+        Blocks until a slot is free for this process's group.
+
+        Returns:
+            str: The slot id, to pass to `release`.
+        """
+        slot_id = f"{os.getpid()}:{threading.get_ident()}:{time.monotonic_ns()}"
+        while True:
+            with FileLock(self.lock_path):
+                holders, waiting = self.load()
+                now = self.clock()
+                taken = self.try_take(slot_id, holders, waiting, now)
+                if not taken:
+                    waiting[slot_id] = [self.group, now]
+                self.save(holders, waiting)
+            if taken:
+                return slot_id
+            time.sleep(self.poll_seconds)
+
+    def release(self, slot_id):
+        with FileLock(self.lock_path):
+            holders, waiting = self.load()
+            holders.pop(slot_id, None)
+            waiting.pop(slot_id, None)
+            self.save(holders, waiting)
+
+    @contextmanager
+    def slot(self):
+        """Holds a slot for the duration of a `with` block."""
+        slot_id = self.acquire()
+        try:
+            yield
+        finally:
+            self.release(slot_id)
+
+
+def slots_from_env():
+    """
+    Builds the shared concurrency limit configured by the GEMINI_SLOTS, GEMINI_SLOTS_STATE and
+    GEMINI_GROUP environment variables.
+
+    Returns:
+        SharedSlots: The limit, or None if GEMINI_SLOTS is not set.
+    """
+    limit = int(os.environ.get("GEMINI_SLOTS", 0))
+    if not limit:
+        return None
+    return SharedSlots(limit, os.environ.get("GEMINI_SLOTS_STATE", DEFAULT_SLOTS_FILE),
+                       os.environ.get("GEMINI_GROUP", "default"))
@@ -0,0 +1,199 @@
+import hashlib
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+
+DEFAULT_CACHE_DIR = ".gemini_cache"
+DEFAULT_MAX_MB = 512
+
+
+class ResponseCache:
+    """
+    An on-disk cache of successful API responses, addressed by a hash of the request.
+
+    Each entry is one JSON file named after the SHA-256 of (model URL, prompt, generation
+    config). Entries are written to a temporary file and renamed into place, so several
+    processes can share one cache directory without ever reading a partial entry. Every
+    entry keeps a hit count; hits refresh the file's modification time, which drives
+    least-recently-used eviction once the directory grows past `max_bytes`.
+    """
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_MB * 1024 * 1024):
+        """
+        Args:
+            directory (str): Directory holding the cache entries.
+            max_bytes (int): Size above which the least recently used entries are evicted.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.size = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(url, prompt, generation_config=None):
+        """Returns the cache key of a request."""
+        material = json.dumps([url, prompt, generation_config or {}], sort_keys=True)
+        return hashlib.sha256(material.encode('utf-8')).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        """
+        Looks up an entry and records the hit or miss.
+
+        Returns:
+            dict: The cached entry, or None on a miss.
+        """
+        path = self.path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+        except (FileNotFoundError, ValueError):
+            with self.lock:
+                self.misses += 1
+            return None
+
+        with self.lock:
+            self.hits += 1
+        entry["hits"] = entry.get("hits", 0) + 1
+        entry["last_hit"] = time.time()
+        self.write(path, entry)
+        return entry
+
+    def put(self, key, entry):
+        """Stores an entry, evicting old entries if the cache has grown too large."""
+        entry = dict(entry, hits=0, created=time.time())
+        written = self.write(self.path(key), entry)
+        with self.lock:
+            if self.size is None:
+                self.size = self.disk_usage()
+            else:
+                self.size += written
+            over_limit = self.size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def delete(self, key):
+        """Removes an entry, if it exists."""
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def write(self, path, entry):
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        data = json.dumps(entry).encode('utf-8')
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        return len(data)
+
+    def entries(self):
+        """Yields (path, size, mtime) for every entry on disk."""
+        if not os.path.isdir(self.directory):
+            return
+        for shard in os.listdir(self.directory):
+            shard_dir = os.path.join(self.directory, shard)
+            if not os.path.isdir(shard_dir):
+                continue
+            for name in os.listdir(shard_dir):
+                if not name.endswith(".json"):
+                    continue
+                path = os.path.join(shard_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                yield path, stat.st_size, stat.st_mtime
+
+    def disk_usage(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Removes least recently used entries until the cache fits in `max_bytes`."""
+        entries = sorted(self.entries(), key=lambda entry: entry[2])
+        total = sum(size for _, size, _ in entries)
+        for path, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        with self.lock:
+            self.size = total
+
+    def stats(self):
+        """Returns hit/miss counts for this process and the size of the cache on disk."""
+        entries = list(self.entries())
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(entries),
+            "bytes": sum(size for _, size, _ in entries),
+        }
+
+
+def cache_from_env():
+    """
+    Builds the response cache configured by the environment.
+
+    The cache is on by default in .gemini_cache; GEMINI_CACHE_DIR moves it, GEMINI_CACHE_MAX_MB
+    sets its size limit and GEMINI_CACHE=0 turns it off.
+
+    Returns:
+        ResponseCache: The cache, or None if caching is disabled.
+    """
+    if os.environ.get("GEMINI_CACHE", "1") == "0":
+        return None
+    max_mb = int(os.environ.get("GEMINI_CACHE_MAX_MB", DEFAULT_MAX_MB))
+    return ResponseCache(os.environ.get("GEMINI_CACHE_DIR", DEFAULT_CACHE_DIR), max_mb * 1024 * 1024)
+
+
+def main():
+    """
+    Prints statistics about the response cache, or clears it.
+    """
+    if len(sys.argv) < 2 or sys.argv[1] not in ("stats", "clear"):
+        print("Usage: python response_cache.py stats|clear [cache_dir]")
+        sys.exit(1)
+
+    cache = ResponseCache(sys.argv[2] if len(sys.argv) > 2 else os.environ.get("GEMINI_CACHE_DIR", DEFAULT_CACHE_DIR))
+    if sys.argv[1] == "clear":
+        removed = 0
+        for path, _, _ in list(cache.entries()):
+            os.remove(path)
+            removed += 1
+        print(f"Removed {removed} cached responses from '{cache.directory}'.")
+        return
+
+    entries = list(cache.entries())
+    total_hits = 0
+    for path, _, _ in entries:
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                total_hits += json.load(f).get("hits", 0)
+        except (FileNotFoundError, ValueError):
+            continue
+    total_bytes = sum(size for _, size, _ in entries)
+    print(f"Cache directory: {cache.directory}")
+    print(f"Entries: {len(entries)} ({total_bytes / (1024 * 1024):.1f} MB)")
+    print(f"Hits recorded across entries: {total_hits}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+import json
+import math
+import os
+import re
+import zlib
+
+import numpy as np
+
+from atomic_files import write_text_atomic
+from build_manifest import hash_text
+
+DEFAULT_INDEX_DIR = ".retrieval_index"
+DIMENSIONS = 1024
+
+
+def tokenize(text):
+    return re.findall(r"[a-z0-9']+", text.lower())
+
+
+def vectorize(text, dims=DIMENSIONS):
+    """
+    Turns text into a hashed bag of words and word pairs with sublinear term frequencies.
+
+    Features are hashed with CRC32 (stable across runs, unlike hash()) into `dims` buckets,
+    with a hash-derived sign so that collisions cancel out instead of piling up.
+    """
+    words = tokenize(text)
+    features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    counts = {}
+    for feature in features:
+        h = zlib.crc32(feature.encode('utf-8'))
+        bucket = h % dims
+        counts[bucket] = counts.get(bucket, 0.0) + (1.0 if h & 0x80000000 else -1.0)
+    vector = np.zeros(dims, dtype=np.float32)
+    for bucket, count in counts.items():
+        vector[bucket] = math.copysign(1 + math.log(abs(count)), count) if count else 0.0
+    return vector
+
+
+def split_passages(text, min_words=120):
+    """Groups consecutive paragraphs into passages of at least `min_words` words."""
+    passages = []
+    current = []
+    words = 0
+    for paragraph in text.split('\n'):
+        if not paragraph.strip():
+            continue
+        current.append(paragraph.strip())
+        words += len(paragraph.split())
+        if words >= min_words:
+            passages.append("\n".join(current))
+            current, words = [], 0
+    if current:
+        passages.append("\n".join(current))
+    return passages
+
+
+class RetrievalIndex:
+    """
+    A local search index over generated chapters and continuity notes.
+
+    Every source file is split into passages of a few paragraphs, each stored as a hashed
+    n-gram vector. Queries are ranked by cosine similarity with inverse-document-frequency
+    weights, so rare words such as character and place names dominate the match. Sources are
+    re-indexed only when their text changes, and the index is saved to `directory` (vectors as
+    a .npy matrix, passage texts as JSON), so adding a chapter costs milliseconds.
+    """
+
+    def __init__(self, directory=DEFAULT_INDEX_DIR, dims=DIMENSIONS):
+        self.directory = directory
+        self.dims = dims
+        self.passages = []
+        self.sources = {}
+        self.vectors = np.zeros((0, dims), dtype=np.float32)
+        self.dirty = False
+        self.load()
+
+    def load(self):
+        try:
+            with open(os.path.join(self.directory, "passages.json"), 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            vectors = np.load(os.path.join(self.directory, "vectors.npy"))
+        except (FileNotFoundError, ValueError):
+            return
+        if meta.get("dims") != self.dims or len(vectors) != len(meta["passages"]):
+            return
+        self.passages = meta["passages"]
+        self.sources = meta["sources"]
+        self.vectors = vectors
+
+    def save(self):
+        """Writes the index to disk if it changed since it was loaded or last saved."""
+        if not self.dirty:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        vectors_path = os.path.join(self.directory, "vectors.npy")
+        temp_path = f"{vectors_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'wb') as f:
+            np.save(f, self.vectors)
+        os.replace(temp_path, vectors_path)
+        meta = {"dims": self.dims, "sources": self.sources, "passages": self.passages}
+        write_text_atomic(os.path.join(self.directory, "passages.json"), json.dumps(meta))
+        self.dirty = False
+
+    def update(self, source, chapter, text):
+        """
+        Indexes the text of a source file, replacing what was indexed for it before.
+
+        Args:
+            source (str): The file the text comes from, e.g. "chapters/chapter_12.txt".
+            chapter (int): The chapter the text belongs to.
+            text (str): The text to index.
+
+        Returns:
+            bool: True if the index changed.
+        """
+        digest = hash_text(text)
+        if self.sources.get(source) == digest:
+            return False
+        keep = [i for i, passage in enumerate(self.passages) if passage["source"] != source]
+        new_passages = split_passages(text)
+        self.passages = [self.passages[i] for i in keep] + [
+            {"source": source, "chapter": chapter, "text": passage} for passage in new_passages]
+        new_vectors = np.array([vectorize(p, self.dims) for p in new_passages], dtype=np.float32).reshape(-1, self.dims)
+        self.vectors = np.vstack([self.vectors[keep], new_vectors])
+        self.sources[source] = digest
+        self.dirty = True
+        return True
+
+    def search(self, query, k=5, before_chapter=None):
+        """
+        Finds the passages most similar to `query`.
+
+        Args:
+            query (str): The text to match, e.g. the outline summary of the next chapter.
+            k (int): Maximum number of passages to return.
+            before_chapter (int): Only consider passages from chapters before this one.
+
+        Returns:
+            list: (score, passage) pairs, best first, where passage is a dict with "source",
+            "chapter" and "text".
+        """
+        if not self.passages:
+            return []
+        rows = np.arange(len(self.passages))
+        if before_chapter is not None:
+            rows = rows[np.array([p["chapter"] < before_chapter for p in self.passages])]
+        if len(rows) == 0:
+            return []
+        matrix = self.vectors[rows]
+        document_frequency = np.count_nonzero(matrix, axis=0)
+        idf = np.log((1 + len(rows)) / (1 + document_frequency)).astype(np.float32) + 1
+        weighted = matrix * idf
+        norms = np.linalg.norm(weighted, axis=1)
+        norms[norms == 0] = 1
+        query_vector = vectorize(query, self.dims) * idf
+        query_norm = np.linalg.norm(query_vector)
+        if query_norm == 0:
+            return []
+        scores = weighted @ query_vector / (norms * query_norm)
+        best = np.argsort(-scores)[:k]
+        return [(float(scores[i]), self.passages[rows[i]]) for i in best if scores[i] > 0]
+
+    def context(self, query, before_chapter, max_words=600, k=6):
+        """
+        Formats the best matching passages for a prompt, keeping at most `max_words` words.
+
+        Passages are listed in story order, each labelled with its chapter.
+
+        Returns:
+            str: The passages, or "" if nothing relevant is indexed.
+        """
+        chosen = []
+        words = 0
+        for _, passage in self.search(query, k, before_chapter):
+            length = len(passage["text"].split())
+            if words + length > max_words:
+                continue
+            chosen.append(passage)
+            words += length
+        chosen.sort(key=lambda p: (p["chapter"], p["source"]))
+        return "\n\n".join(f"From chapter {p['chapter']}:\n{p['text']}" for p in chosen)
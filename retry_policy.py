@@ -0,0 +1,92 @@
+import email.utils
+import random
+import threading
+import time
+
+# Responses worth asking again for: rate limiting and the server errors that usually pass.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+
+def parse_retry_after(value, now=None):
+    """
+    Reads a Retry-After header, given either in seconds or as an HTTP date.
+
+    Returns:
+        float: Seconds to wait, or None if the header is missing or malformed.
+    """
+    if not value:
+        return None
+    value = value.strip()
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when is None:
+        return None
+    return max(0.0, when.timestamp() - (time.time() if now is None else now))
+
+
+class RetryPolicy:
+    """
+    Decides whether and when a failed API call is tried again.
+
+    Waits use "full jitter" exponential backoff, a random time between zero and
+    `base * 2 ** attempt` seconds capped at `cap`, so clients that failed together do not retry
+    together. A Retry-After header sent by the server takes precedence.
+
+    Retries also draw on a budget shared by every call of the run: at most `budget_minimum`
+    retries plus `budget_ratio` retries per request made. A short outage is ridden out, but
+    an API that keeps failing is given up on quickly instead of being hammered all night.
+    The policy is safe to share between threads.
+    """
+
+    def __init__(self, max_attempts=5, base=1.0, cap=60.0, max_retry_after=300.0, budget_ratio=0.2,
+                 budget_minimum=10):
+        """
+        Args:
+            max_attempts (int): Maximum number of attempts per call, the first included.
+            base (float): Backoff ceiling of the first retry, in seconds.
+            cap (float): Largest backoff ceiling, in seconds.
+            max_retry_after (float): Longest Retry-After wait that is honoured as is.
+            budget_ratio (float): Retries allowed per request made during the run.
+            budget_minimum (int): Retries allowed regardless of the number of requests.
+        """
+        self.max_attempts = max_attempts
+        self.base = base
+        self.cap = cap
+        self.max_retry_after = max_retry_after
+        self.budget_ratio = budget_ratio
+        self.budget_minimum = budget_minimum
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Returns how many seconds to wait before retrying after the failed attempt number
+        `attempt` (counting from 0).
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_retry_after)
+        return random.uniform(0, min(self.cap, self.base * (2 ** attempt)))
+
+    def record_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def allow_retry(self, attempt):
+        """
+        Checks whether the call may be tried again after the failed attempt number `attempt`,
+        and if so spends one retry from the run's budget.
+        """
+        if attempt >= self.max_attempts - 1:
+            return False
+        with self.lock:
+            if self.retries >= self.budget_minimum + self.budget_ratio * self.requests:
+                return False
+            self.retries += 1
+            return True
@@ -0,0 +1,259 @@
+import argparse
+import contextvars
+import importlib.util
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from story_outline import completed_path
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+# The pipeline stage the current thread or task works for, read by StageOutput.
+CURRENT_STAGE = contextvars.ContextVar("stage", default=None)
+
+
+class Stage:
+    """
+    One step of the pipeline: a script whose main() is called in-process.
+
+    Attributes:
+        name (str): Short name used in logs and the timing report.
+        script (str): Path of the script, relative to the repository root.
+        argv (list): Arguments passed to the script's main(), or None if it takes none.
+        deps (tuple): Names of the stages that must succeed first.
+    """
+
+    def __init__(self, name, script, argv=None, deps=()):
+        self.name = name
+        self.script = script
+        self.argv = argv
+        self.deps = tuple(deps)
+        self.status = "pending"
+        self.attempts = 0
+        self.seconds = 0.0
+
+
+class StageOutput:
+    """
+    A stdout replacement that prefixes every line printed by a stage with its name.
+
+    The stage name is kept in a context variable, so the stage's own thread pools and helper
+    threads carry it too when they run their tasks through thread_context.carry_context.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def set_stage(self, name):
+        CURRENT_STAGE.set(name)
+        self.local.buffer = ""
+
+    def write(self, text):
+        name = CURRENT_STAGE.get()
+        if name is None:
+            return self.stream.write(text)
+        lines = (getattr(self.local, 'buffer', "") + text).split('\n')
+        self.local.buffer = lines.pop()
+        with self.lock:
+            for line in lines:
+                self.stream.write(f"[{name}] {line}\n")
+        return len(text)
+
+    def finish_stage(self):
+        if getattr(self.local, 'buffer', ""):
+            self.write("\n")
+        CURRENT_STAGE.set(None)
+
+    def flush(self):
+        self.stream.flush()
+
+
+def load_main(script):
+    """
+    Imports a pipeline script by path (the numbered file names are not valid module names)
+    and returns its main function.
+    """
+    path = os.path.join(SCRIPTS_DIR, script)
+    module_name = "stage_" + os.path.splitext(os.path.basename(script))[0]
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.main
+
+
+def call_main(main, argv):
+    """
+    Calls a script's main() and converts its outcome into an exit status.
+    """
+    try:
+        status = main(argv) if argv is not None else main()
+    except SystemExit as e:
+        status = e.code
+    except Exception as e:
+        print(f"An error occurred: {e}")
+        status = 1
+    return 0 if status in (None, 0) else status
+
+
+def run_stage(stage, output, retries, retry_delay):
+    """
+    Runs a stage, retrying it up to `retries` times if it fails. Every script resumes from
+    what is already on disk, so a retry only redoes the work that failed.
+    """
+    output.set_stage(stage.name)
+    start = time.monotonic()
+    try:
+        main = load_main(stage.script)
+        for attempt in range(1, retries + 2):
+            stage.attempts = attempt
+            if call_main(main, stage.argv) == 0:
+                stage.status = "ok"
+                break
+            stage.status = "failed"
+            if attempt <= retries:
+                wait_time = retry_delay * attempt
+                print(f"Stage failed (attempt {attempt}). Retrying in {wait_time} seconds...")
+                time.sleep(wait_time)
+    finally:
+        stage.seconds = time.monotonic() - start
+        output.finish_stage()
+    return stage
+
+
+def run_stages(stages, retries=2, retry_delay=10):
+    """
+    Runs the stages as a dependency graph, starting every stage as soon as all of its
+    dependencies have succeeded. Stages whose dependencies failed are skipped.
+
+    Returns:
+        bool: True if every stage succeeded.
+    """
+    output = StageOutput(sys.stdout)
+    sys.stdout = output
+    pending = {stage.name: stage for stage in stages}
+    by_name = dict(pending)
+    running = {}
+    try:
+        with ThreadPoolExecutor(max_workers=len(stages)) as executor:
+            while pending or running:
+                for name, stage in list(pending.items()):
+                    dep_status = [by_name[dep].status for dep in stage.deps if dep in by_name]
+                    if any(status in ("failed", "skipped") for status in dep_status):
+                        stage.status = "skipped"
+                        del pending[name]
+                    elif all(status == "ok" for status in dep_status):
+                        stage.status = "running"
+                        running[executor.submit(run_stage, stage, output, retries, retry_delay)] = stage
+                        del pending[name]
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    running.pop(future)
+                    future.result()
+    finally:
+        sys.stdout = output.stream
+    return all(stage.status == "ok" for stage in stages)
+
+
+def print_report(stages, wall_time):
+    print("\nPipeline timing report")
+    print("----------------------")
+    for stage in stages:
+        print(f"{stage.name:<10} {stage.status:<8} attempts: {stage.attempts:<2} {stage.seconds:9.1f}s")
+    print(f"{'total':<10} {'':<8} {'':<12} {wall_time:9.1f}s")
+
+
+# Options that change how the stages run, as the attribute names add_stage_arguments gives them.
+STAGE_FLAGS = ("outline_by_arc", "pipelined", "speculative", "combined", "stream", "enhance_by_section")
+
+
+def add_stage_arguments(parser):
+    """Adds the STAGE_FLAGS options, shared by run_pipeline.py, batch_runner.py and benchmark.py."""
+    parser.add_argument("--outline-by-arc", action="store_true",
+                        help="Pass --by-arc to the outline stage.")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Pass --pipelined to the chapter stage.")
+    parser.add_argument("--speculative", action="store_true",
+                        help="Pass --speculative to the chapter stage.")
+    parser.add_argument("--combined", action="store_true",
+                        help="Pass --combined to the chapter stage.")
+    parser.add_argument("--stream", action="store_true",
+                        help="Stream chapter and enhancement calls straight to their output files.")
+    parser.add_argument("--enhance-by-section", action="store_true",
+                        help="Pass --by-section to the enhancement stage.")
+
+
+def build_stages(args, chapters=None):
+    """
+    Builds the pipeline's stages from the parsed options.
+
+    Args:
+        args: Options with `story_info`, `concurrency` and the STAGE_FLAGS.
+        chapters (int): If given, the number of chapters passed to the outline stage.
+    """
+    outline_args = [args.story_info]
+    if chapters is not None:
+        outline_args += ["--chapters", str(chapters)]
+    if args.outline_by_arc:
+        outline_args.append("--by-arc")
+    chapter_args = ["--pipelined"] if args.pipelined else []
+    if args.speculative:
+        chapter_args.append("--speculative")
+    if args.combined:
+        chapter_args.append("--combined")
+    enhance_args = ["--concurrency", str(args.concurrency)]
+    if args.stream:
+        chapter_args.append("--stream")
+        enhance_args.append("--stream")
+    if args.enhance_by_section:
+        enhance_args.append("--by-section")
+    return [
+        Stage("outline", "01_make_story_outline.py", outline_args),
+        Stage("blurb", os.path.join("scripts_v1.9", "99_blurp_maker.py"), [args.story_info]),
+        Stage("chapters", "02.py", ["--outline", completed_path(args.story_info)] + chapter_args, deps=("outline",)),
+        Stage("enhance", "03.py", enhance_args, deps=("chapters",)),
+        Stage("titles", os.path.join("scripts_v1.9", "99_titler.py"), [], deps=("enhance",)),
+        Stage("schedule", os.path.join("scripts_v1.9", "99_post_timer.py"), deps=("titles",)),
+    ]
+
+
+def main(argv=None):
+    """
+    Runs the whole book pipeline (outline, chapters, enhancement, blurb, titles, posting
+    schedule) in the current directory.
+    """
+    parser = argparse.ArgumentParser(description="Run every stage of the book pipeline in one process.")
+    parser.add_argument("story_info", nargs="?", default="story_info.txt",
+                        help="The story info file the book is built from, by the outline and blurb stages "
+                             "(default: story_info.txt).")
+    parser.add_argument("--workspace", default=None,
+                        help="Directory holding the book's files, where every stage runs (default: the current directory).")
+    parser.add_argument("--skip", default="",
+                        help="Comma-separated stage names to leave out, e.g. 'blurb,schedule'.")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="How many times to retry a failed stage.")
+    parser.add_argument("--retry-delay", type=float, default=10,
+                        help="Seconds to wait before the first retry; later retries wait longer.")
+    add_stage_arguments(parser)
+    parser.add_argument("--concurrency", type=int, default=4,
+                        help="Number of chapters enhanced at the same time.")
+    args = parser.parse_args(argv)
+
+    if args.workspace:
+        os.chdir(args.workspace)
+    skipped = {name.strip() for name in args.skip.split(',') if name.strip()}
+    stages = [stage for stage in build_stages(args) if stage.name not in skipped]
+
+    start = time.monotonic()
+    success = run_stages(stages, args.retries, args.retry_delay)
+    print_report(stages, time.monotonic() - start)
+    return 0 if success else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
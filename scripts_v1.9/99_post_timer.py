@@ -2,6 +2,11 @@ import os
 import sys
 from datetime import datetime, timedelta
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from atomic_files import write_text_atomic
+from build_manifest import BuildManifest, hash_inputs
+
 def main():
     """
     Reads a chapter titles file and adds a posting date to each title.
@@ -21,8 +26,16 @@ def main():
         if lines and "Generated Chapter Titles" in lines[0]:
             lines = lines[2:]
 
-        # Get current time and set the hour to 3 a.m. for the first post
-        current_time = datetime.now().replace(hour=3, minute=0, second=0, microsecond=0)
+        # Keep the existing schedule if the set of chapters has not changed since it was made,
+        # otherwise start from the current day with the first post at 3 a.m.
+        manifest = BuildManifest()
+        scheduled_files = [line.split(":", 1)[0].strip() for line in lines if line.strip() and ":" in line and "(Posted:" not in line]
+        schedule_inputs = hash_inputs(*scheduled_files)
+        schedule_start = manifest.value("schedule", schedule_inputs)
+        if schedule_start:
+            current_time = datetime.fromisoformat(schedule_start)
+        else:
+            current_time = datetime.now().replace(hour=3, minute=0, second=0, microsecond=0)
         
         updated_lines = []
         for i, line in enumerate(lines):
@@ -67,11 +80,8 @@ def main():
             updated_lines.append(formatted_line)
         
         # Write the updated content back to the file
-        with open(titles_file, 'w', encoding='utf-8') as outfile:
-            outfile.write("Generated Chapter Titles\n")
-            outfile.write("------------------------\n\n")
-            for line in updated_lines:
-                outfile.write(line)
+        write_text_atomic(titles_file, "Generated Chapter Titles\n------------------------\n\n" + "".join(updated_lines))
+        manifest.record("schedule", schedule_inputs, value=current_time.isoformat())
             
         print(f"\nSuccessfully updated '{titles_file}' with posting dates.")
             
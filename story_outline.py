@@ -0,0 +1,245 @@
+import json
+import os
+import re
+
+from atomic_files import write_text_atomic
+
+CHAPTER_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "chapter": {"type": "INTEGER", "description": "The chapter number, starting at 1."},
+        "summary": {"type": "STRING", "description": "A detailed, long paragraph describing the chapter's events."},
+        "pov": {"type": "STRING", "description": "The point-of-view character of the chapter."},
+        "characters": {"type": "ARRAY", "items": {"type": "STRING"},
+                       "description": "Names of the characters who appear in the chapter."},
+    },
+    "required": ["chapter", "summary", "pov", "characters"],
+}
+OUTLINE_CONFIG = {
+    "responseMimeType": "application/json",
+    "responseSchema": {"type": "ARRAY", "items": CHAPTER_SCHEMA},
+}
+
+
+ARC_HEADING = re.compile(r"^\s*Arc\s+\d+\b", re.IGNORECASE)
+
+
+def completed_path(story_info_path):
+    """Returns the outline text file written for a story info file ("x.txt" -> "x_completed.txt")."""
+    base, extension = os.path.splitext(story_info_path)
+    return f"{base}_completed{extension}"
+
+
+def outline_path(text_path):
+    """Returns the JSON outline file that goes with an outline text file ("x_completed.txt" -> "x_outline.json")."""
+    base = os.path.splitext(text_path)[0]
+    if base.endswith("_completed"):
+        base = base[:-len("_completed")]
+    return f"{base}_outline.json"
+
+
+def validate_chapters(entries):
+    """
+    Checks structured outline output and normalizes it.
+
+    Args:
+        entries: The decoded JSON response, a list of chapter objects.
+
+    Returns:
+        list: The chapters as dicts with "chapter", "summary", "pov" and "characters", in order.
+
+    Raises:
+        ValueError: If the outline is empty, an entry is malformed, or the chapter numbers
+            are not exactly 1 to N.
+    """
+    if isinstance(entries, dict) and isinstance(entries.get("chapters"), list):
+        entries = entries["chapters"]
+    if not isinstance(entries, list) or not entries:
+        raise ValueError("expected a non-empty JSON array of chapters")
+
+    chapters = []
+    for position, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"entry {position} is not an object")
+        number = entry.get("chapter")
+        summary = entry.get("summary")
+        if isinstance(number, str) and number.strip().isdigit():
+            number = int(number)
+        if not isinstance(number, int) or isinstance(number, bool):
+            raise ValueError(f"entry {position} has no chapter number")
+        if not isinstance(summary, str) or not summary.strip():
+            raise ValueError(f"chapter {number} has an empty summary")
+        pov = entry.get("pov") if isinstance(entry.get("pov"), str) else ""
+        characters = [c.strip() for c in entry.get("characters") or [] if isinstance(c, str) and c.strip()]
+        chapters.append({
+            "chapter": number,
+            # One paragraph per chapter: blank lines inside a summary must not split it.
+            "summary": re.sub(r"\n\s*\n", "\n", summary).strip(),
+            "pov": pov.strip(),
+            "characters": characters,
+        })
+
+    chapters.sort(key=lambda c: c["chapter"])
+    numbers = [c["chapter"] for c in chapters]
+    if numbers != list(range(1, len(chapters) + 1)):
+        raise ValueError(f"chapter numbers are not 1 to {len(chapters)} without gaps or repeats")
+    return chapters
+
+
+def parse_outline(text):
+    """
+    Decodes and validates a structured outline response.
+
+    Raises:
+        ValueError: If the text is not valid JSON or not a valid outline.
+    """
+    return validate_chapters(json.loads(text))
+
+
+def number_chapters(entries, first_chapter=1):
+    """
+    Validates the chapters returned for one part of the book and numbers them from
+    `first_chapter`, keeping the order of the numbers the model gave them.
+
+    Raises:
+        ValueError: If the entries are not a valid outline.
+    """
+    if isinstance(entries, list):
+        def order(entry):
+            number = entry.get("chapter") if isinstance(entry, dict) else None
+            return number if isinstance(number, int) and not isinstance(number, bool) else 0
+        entries = sorted(entries, key=order)
+        entries = [dict(entry, chapter=n) if isinstance(entry, dict) else entry for n, entry in enumerate(entries, 1)]
+    chapters = validate_chapters(entries)
+    for chapter in chapters:
+        chapter["chapter"] += first_chapter - 1
+    return chapters
+
+
+def split_arcs(story_info):
+    """
+    Splits story info into its arc sections and everything else.
+
+    An arc section starts at a line such as "Arc 02" and runs to the next blank line.
+
+    Returns:
+        tuple: (background, arcs) where background is the story info without the arc sections
+        and arcs lists the text of each arc section in order.
+    """
+    background = []
+    arcs = []
+    in_arc = False
+    for line in story_info.splitlines():
+        if ARC_HEADING.match(line):
+            arcs.append([line])
+            in_arc = True
+        elif in_arc and line.strip():
+            arcs[-1].append(line)
+        else:
+            in_arc = False
+            background.append(line)
+    background_text = re.sub(r"\n{3,}", "\n\n", "\n".join(background)).strip()
+    return background_text, ["\n".join(arc).strip() for arc in arcs]
+
+
+def distribute_chapters(weights, total):
+    """
+    Splits `total` chapters between parts in proportion to `weights`, giving every part at
+    least one chapter. Leftover chapters go to the largest remainders, earlier parts first, so
+    the same weights always give the same split.
+
+    Returns:
+        list: The number of chapters of each part, summing to `total`.
+
+    Raises:
+        ValueError: If `total` is smaller than the number of parts.
+    """
+    if total < len(weights):
+        raise ValueError(f"cannot split {total} chapters between {len(weights)} parts")
+    weights = [w if isinstance(w, (int, float)) and w > 0 else 1 for w in weights]
+    spare = total - len(weights)
+    shares = [spare * w / sum(weights) for w in weights]
+    counts = [1 + int(share) for share in shares]
+    by_remainder = sorted(range(len(weights)), key=lambda i: (-(shares[i] - int(shares[i])), i))
+    for i in by_remainder[:total - sum(counts)]:
+        counts[i] += 1
+    return counts
+
+
+def arc_parts(chapters, beats, max_chapters):
+    """
+    Splits an arc into consecutive parts of at most `max_chapters` chapters, sharing out its
+    beats in order. Every part gets at least one beat; with fewer beats than parts, neighbouring
+    parts share one.
+
+    Returns:
+        list: (chapter count, beats) pairs, one per part.
+    """
+    count = -(-chapters // max_chapters)
+    parts = []
+    for part, part_chapters in enumerate(distribute_chapters([1] * count, chapters)):
+        start = part * len(beats) // count
+        end = max(start + 1, (part + 1) * len(beats) // count)
+        parts.append((part_chapters, beats[start:end]))
+    return parts
+
+
+def chapters_from_text(text):
+    """Builds outline entries from a free-text outline with one paragraph per chapter."""
+    summaries = [s.strip() for s in text.split('\n\n') if s.strip()]
+    return [{"chapter": n, "summary": s, "pov": "", "characters": []} for n, s in enumerate(summaries, 1)]
+
+
+def merge_outline_text(chapters, text):
+    """
+    Rebuilds the outline from a hand-edited text outline. Chapters whose summary is unchanged
+    keep the point of view and cast of the structured outline, wherever they now are, so only
+    the edited chapters' briefs change.
+
+    Returns:
+        list: The chapters of the text outline, numbered from 1.
+    """
+    unchanged = {}
+    for chapter in chapters:
+        unchanged.setdefault(chapter["summary"].strip(), []).append(chapter)
+    merged = chapters_from_text(text)
+    for entry in merged:
+        matches = unchanged.get(entry["summary"])
+        if matches:
+            original = matches.pop(0)
+            entry["pov"] = original.get("pov", "")
+            entry["characters"] = original.get("characters", [])
+    return merged
+
+
+def outline_text(chapters):
+    """Renders the outline as text, one paragraph per chapter, in the layout of the old free-text outline."""
+    return "\n\n".join(c["summary"] for c in chapters) + "\n"
+
+
+def save_outline(path, chapters):
+    write_text_atomic(path, json.dumps({"chapters": chapters}, indent=1))
+
+
+def load_outline(path):
+    """
+    Loads a JSON outline file.
+
+    Returns:
+        list: The chapters, where chapters[n - 1] is chapter n.
+    """
+    with open(path, 'r', encoding='utf-8') as f:
+        return validate_chapters(json.load(f))
+
+
+def chapter_brief(chapter):
+    """
+    Returns the text a chapter is written from: its summary, followed by the point of view and
+    the cast when the outline names them.
+    """
+    lines = [chapter["summary"]]
+    if chapter.get("pov"):
+        lines.append(f"Point of view: {chapter['pov']}")
+    if chapter.get("characters"):
+        lines.append(f"Characters: {', '.join(chapter['characters'])}")
+    return "\n".join(lines)
@@ -0,0 +1,184 @@
+import json
+import re
+
+from atomic_files import write_text_atomic
+from build_manifest import hash_inputs
+from prompt_budget import trim_text
+
+DEFAULT_STATE_FILE = "story_state.json"
+ARC_SIZE = 10
+REGISTRY_HEADING = "Characters and items:"
+REGISTRY_INSTRUCTION = (
+    f"After the summary, add a section headed '{REGISTRY_HEADING}' listing every named character and "
+    f"important item that appears in the chapter, one per line in the form '- Name: who or what it is and "
+    f"its current state'. Keep names spelled exactly as in the chapter."
+)
+
+
+def split_note(note):
+    """
+    Splits a continuity note into its summary and its registry entries.
+
+    Returns:
+        tuple: (summary, entries) where entries is a list of (name, description) pairs. Notes
+        written without a registry section return all of their text as the summary.
+    """
+    lines = note.splitlines()
+    for index, line in enumerate(lines):
+        if line.strip().strip('*#').strip().lower() == REGISTRY_HEADING.lower():
+            break
+    else:
+        return note.strip(), []
+
+    entries = []
+    for line in lines[index + 1:]:
+        match = re.match(r"\s*[-*]\s*\**([^:*]+?)\**\s*:\s*(.+)", line)
+        if match:
+            entries.append((match.group(1).strip(), match.group(2).strip()))
+    return "\n".join(lines[:index]).strip(), entries
+
+
+class StoryState:
+    """
+    A compact memory of the book written so far, updated one chapter at a time.
+
+    The state holds a registry of named characters and items (with the chapters they were last
+    seen in) and a hierarchy of summaries: one per chapter (its continuity note), one per arc of
+    `arc_size` chapters, and a rolling summary of the whole book. `context_sections` cuts a slice of it
+    to a fixed size for a chapter prompt, so prompts stay the same length however long the book
+    gets while still carrying details from chapters far behind.
+
+    Chapter notes and the registry are rebuilt from the note files on every run. Arc and book
+    summaries cost an API call each, so they are kept in the state file together with the hash
+    of what they were built from and are only rebuilt when that changes.
+    """
+
+    def __init__(self, path=DEFAULT_STATE_FILE, arc_size=ARC_SIZE):
+        self.path = path
+        self.arc_size = arc_size
+        self.chapters = {}
+        self.registry = {}
+        self.arcs = {int(arc): entry for arc, entry in self.load().get("arcs", {}).items()}
+
+    def load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save(self):
+        state = {"arcs": {str(arc): entry for arc, entry in sorted(self.arcs.items())}}
+        write_text_atomic(self.path, json.dumps(state, indent=1))
+
+    def add_chapter(self, chapter_number, note):
+        """
+        Records the continuity note of a chapter and the characters and items it lists.
+
+        Notes are added in chapter order, so each registry entry keeps its latest description.
+        """
+        summary, entries = split_note(note)
+        self.chapters[chapter_number] = summary
+        for name, description in entries:
+            entry = self.registry.setdefault(name, {"first": chapter_number})
+            entry["first"] = min(entry["first"], chapter_number)
+            entry["last"] = chapter_number
+            entry["description"] = description
+
+    def arc_chapters(self, arc):
+        return range(arc * self.arc_size + 1, (arc + 1) * self.arc_size + 1)
+
+    def consolidate(self, client):
+        """
+        Builds the summary of every completed arc whose chapters changed, then the book summary
+        that follows it. Failures are reported and left for the next run; chapter prompts fall
+        back to the chapter notes meanwhile.
+
+        Returns:
+            bool: True if every completed arc is summarized.
+        """
+        arc = 0
+        previous_book = ""
+        changed = False
+        ok = True
+        while all(n in self.chapters for n in self.arc_chapters(arc)):
+            numbers = self.arc_chapters(arc)
+            notes = [self.chapters[n] for n in numbers]
+            inputs = hash_inputs(previous_book, *notes)
+            entry = self.arcs.get(arc)
+            if entry is None or entry["inputs"] != inputs:
+                entry = self.summarize_arc(client, numbers, notes, previous_book)
+                if entry is None:
+                    self.arcs.pop(arc, None)
+                    ok = False
+                    break
+                entry["inputs"] = inputs
+                self.arcs[arc] = entry
+                changed = True
+            previous_book = entry["book"]
+            arc += 1
+        if changed:
+            self.save()
+        return ok
+
+    def summarize_arc(self, client, numbers, notes, previous_book):
+        label = f"chapters {numbers[0]}-{numbers[-1]}"
+        chapter_notes = "\n\n".join(f"Chapter {n}: {note}" for n, note in zip(numbers, notes))
+        result = client.generate(
+            f"Write a concise summary of {label} of a novel from the chapter summaries below, in at most 250 "
+            f"words. Keep the events that later chapters depend on: unresolved threads, promises, injuries, "
+            f"possessions and where each character ends up.\n\nChapter summaries:\n{chapter_notes}",
+            stage="arc", chapter=numbers[-1])
+        if not result.ok:
+            print(f"Failed to summarize {label}. Error: {result.error}")
+            return None
+        arc_summary = result.text.strip()
+
+        result = client.generate(
+            f"Update the running summary of a novel with the summary of its latest arc. Write a concise summary "
+            f"of the whole story so far in at most 300 words, giving more room to recent events and to threads "
+            f"that are still open.\n\nStory so far:\n{previous_book or '(The story has just begun.)'}\n\n"
+            f"Latest arc ({label}):\n{arc_summary}",
+            stage="book", chapter=numbers[-1])
+        if not result.ok:
+            print(f"Failed to update the book summary after {label}. Error: {result.error}")
+            return None
+        print(f"Summarized {label}.")
+        return {"summary": arc_summary, "book": result.text.strip()}
+
+    def context_sections(self, chapter_number, chapter_summary, recent=3, max_characters=12):
+        """
+        Builds the story context for a chapter prompt from everything known before it.
+
+        The slice has a fixed maximum size: the book summary up to the last summarized arc, that
+        arc's summary, the notes of the `recent` chapters before this one (the nearest in full),
+        and up to `max_characters` registry entries, preferring the ones named in the chapter's
+        outline summary and then the most recently seen.
+
+        Returns:
+            list: (name, text) pairs for the sections that have content, named "book", "arc",
+            "recent" and "registry".
+        """
+        sections = []
+        done_arcs = [arc for arc in sorted(self.arcs) if self.arc_chapters(arc)[-1] < chapter_number]
+        if done_arcs:
+            last_arc = done_arcs[-1]
+            numbers = self.arc_chapters(last_arc)
+            sections.append(("book", f"Story so far:\n{trim_text(self.arcs[last_arc]['book'], 400)}"))
+            sections.append(("arc", f"Previous arc (chapters {numbers[0]}-{numbers[-1]}):\n"
+                                    f"{trim_text(self.arcs[last_arc]['summary'], 330)}"))
+
+        earlier = [n for n in range(chapter_number - recent, chapter_number) if n in self.chapters]
+        if earlier:
+            notes = [f"Chapter {n}: {trim_text(self.chapters[n], 470 if n == earlier[-1] else 160)}" for n in earlier]
+            sections.append(("recent", "Recent chapters:\n" + "\n\n".join(notes)))
+
+        known = [(name, entry) for name, entry in self.registry.items() if entry["first"] < chapter_number]
+        lowered = chapter_summary.lower()
+        known.sort(key=lambda item: (item[0].lower() not in lowered, -item[1]["last"]))
+        if known:
+            lines = [f"- {name} (last seen in chapter {entry['last']}): {trim_text(entry['description'], 40)}"
+                     for name, entry in known[:max_characters]]
+            sections.append(("registry", f"{REGISTRY_HEADING}\n" + "\n".join(lines)))
+
+        return sections
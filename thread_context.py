@@ -0,0 +1,15 @@
+import contextvars
+
+
+def carry_context(fn):
+    """
+    Wraps `fn` to run with the context variables of the calling thread, in whichever thread
+    calls it. Pool tasks and helper threads started through it keep, for example, the stage
+    name run_pipeline.py prefixes their output with.
+    """
+    context = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        # A context can only be entered by one thread at a time, so every call gets its own copy.
+        return context.copy().run(fn, *args, **kwargs)
+    return run